@@ -1,7 +1,10 @@
 from argparse import ArgumentParser
 
 from . import __version__
+from .config import DEFAULT_PORT, DEFAULT_PREFIX, Instrument, load_config
 from .ioc import Ioc
+from .scheduler import DEFAULT_SCHEDULER_PREFIX
+from .simulator import SimulatedKeithley
 
 __all__ = ["main"]
 
@@ -9,9 +12,44 @@ __all__ = ["main"]
 def main(args=None):
     parser = ArgumentParser()
     parser.add_argument("--version", action="version", version=__version__)
+    parser.add_argument("--port", default=DEFAULT_PORT, help="serial port")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX, help="PV prefix")
+    parser.add_argument(
+        "--scheduler-prefix",
+        default=DEFAULT_SCHEDULER_PREFIX,
+        help="PV prefix for cycling all instruments together",
+    )
+    parser.add_argument(
+        "--config", help="file listing several instruments, overrides --port"
+    )
+    parser.add_argument(
+        "--log-dir", help="directory in which to log readbacks of all instruments"
+    )
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="talk to simulated Keithley 2400s instead of the serial ports",
+    )
     args = parser.parse_args(args)
 
-    Ioc()
+    if args.config:
+        instruments = load_config(args.config)
+    else:
+        instruments = [Instrument(port=args.port, prefix=args.prefix)]
+
+    if args.log_dir:
+        instruments = [
+            instrument._replace(log_dir=instrument.log_dir or args.log_dir)
+            for instrument in instruments
+        ]
+
+    if args.simulate:
+        instruments = [
+            instrument._replace(port=SimulatedKeithley().start().port)
+            for instrument in instruments
+        ]
+
+    Ioc(instruments, scheduler_prefix=args.scheduler_prefix)
 
     # clean up
 
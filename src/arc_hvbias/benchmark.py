@@ -0,0 +1,161 @@
+"""
+Benchmarks for readback throughput, manual ramp timing and cycle duration
+
+Runs against the simulator unless a serial port is given and prints the
+results as JSON, e.g.
+
+    python -m arc_hvbias.benchmark --output results.json
+
+The records are served under a test prefix unless another is given, so that
+a benchmark does not clash with, or drive, a production IOC's PVs.
+
+The IOC is started without an interactive shell so that the benchmark
+exercises the same update loop and cycle control used in production.
+"""
+
+import json
+from argparse import ArgumentParser
+from time import monotonic
+from typing import Any, Dict, List, Optional
+
+from . import __version__
+from .config import Instrument
+from .hvbias import HvBias
+from .ioc import Ioc
+from .simulator import SimulatedKeithley
+
+__all__ = ["main"]
+
+# the PV prefix of the benchmarked device, and of the scheduler that the IOC
+# creates alongside it
+BENCHMARK_PREFIX = "TEST-EA-HV-01"
+# (step size in volts, ramp time in seconds) pairs for the ramp benchmark
+RAMP_MATRIX = [
+    (step_size, seconds) for step_size in (1.0, 5.0, 20.0) for seconds in (0.5, 2.0)
+]
+# the voltage that ramps go to and from
+RAMP_VOLTS = 100.0
+# how long to wait for the IOC to connect to the instrument
+CONNECT_TIMEOUT = 30.0
+
+
+def bench_readbacks(device: HvBias, seconds: float) -> Dict[str, Any]:
+    """
+    Time back to back get_readbacks for a fixed time, the fastest that the
+    link can be polled. The update loop polls at the rate set for its status.
+    """
+    times = []
+    start = monotonic()
+    while monotonic() - start < seconds:
+        before = monotonic()
+        device.k.get_readbacks()
+        times.append(monotonic() - before)
+    elapsed = monotonic() - start
+    return {
+        "seconds": elapsed,
+        "readbacks": len(times),
+        "readbacks_per_second": len(times) / elapsed,
+        "mean_latency": sum(times) / len(times),
+        "max_latency": max(times),
+    }
+
+
+def bench_ramp(device: HvBias, to_volts: float, step_size: float, seconds: float):
+    """
+    Time a single manual ramp and its steps against their schedule
+    """
+    start = monotonic()
+    device.k.voltage_ramp_worker(to_volts, step_size, seconds)
+    duration = monotonic() - start
+
+    errors = [actual - scheduled for scheduled, actual in device.k.step_times]
+    last = device.k.step_times[-1][1] if device.k.step_times else 0.0
+    return {
+        "to_volts": to_volts,
+        "step_size": step_size,
+        "seconds": seconds,
+        "steps": len(errors),
+        "duration": duration,
+        "duration_error": last - seconds,
+        "mean_step_error": sum(errors) / len(errors) if errors else 0.0,
+        "max_step_error": max(errors, default=0.0),
+    }
+
+
+def bench_ramps(device: HvBias) -> List[Dict[str, Any]]:
+    results = []
+    for step_size, seconds in RAMP_MATRIX:
+        # ramp up and back down again so each pair starts from 0 volts
+        for to_volts in (RAMP_VOLTS, 0.0):
+            results.append(bench_ramp(device, to_volts, step_size, seconds))
+    return results
+
+
+def bench_cycle(device: HvBias, repeats: int, hold: float):
+    """
+    Time a complete cycle_control starting from the on voltage
+    """
+    device.repeats.set(repeats)
+    device.hold_time.set(hold)
+    device.k.voltage_ramp_worker(device.on_setpoint.get(), device.step_size.get(), 1.0)
+
+    rise, fall = device.rise_time.get(), device.fall_time.get()
+    nominal = device.nominal_duration()
+
+    start = monotonic()
+    device.cycle_control()
+    duration = monotonic() - start
+    return {
+        "repeats": repeats,
+        "rise_time": rise,
+        "hold_time": hold,
+        "fall_time": fall,
+        "nominal": nominal,
+        "duration": duration,
+        "duration_error": duration - nominal,
+    }
+
+
+def main(args: Optional[List[str]] = None):
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", help="serial port, defaults to the simulator")
+    parser.add_argument("--prefix", default=BENCHMARK_PREFIX, help="PV prefix")
+    parser.add_argument("--output", help="file for the JSON results")
+    parser.add_argument("--readback-time", type=float, default=5.0)
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--hold-time", type=float, default=1.0)
+    parsed = parser.parse_args(args)
+
+    port = parsed.port or SimulatedKeithley().start().port
+    start = monotonic()
+    ioc = Ioc(
+        [Instrument(port=port, prefix=parsed.prefix)],
+        interactive=False,
+        scheduler_prefix=f"{parsed.prefix}-ALL",
+    )
+    # the records are served from here on
+    serving = monotonic() - start
+    device = ioc.devices[0]
+    device.link_up.Wait(CONNECT_TIMEOUT)
+    startup = {"serving": serving, "connected": monotonic() - start}
+    device.k.source_on(1)
+
+    results = {
+        "version": __version__,
+        "simulated": parsed.port is None,
+        "startup": startup,
+        "readbacks": bench_readbacks(device, parsed.readback_time),
+        "ramps": bench_ramps(device),
+        "cycle": bench_cycle(device, parsed.repeats, parsed.hold_time),
+    }
+
+    text = json.dumps(results, indent=2)
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
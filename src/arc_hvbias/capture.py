@@ -0,0 +1,176 @@
+"""
+Captures voltage and current samples into a fixed size ring buffer so that
+transients during depolarisation ramps can be published as waveforms
+"""
+
+from time import monotonic
+from typing import Callable, Optional
+
+import cothread
+import numpy as np
+
+from .keithley import Keithley
+from .response import ResponseError
+
+# samples held in the ring buffer, fixing its memory use regardless of uptime
+CAPTURE_SAMPLES = 65536
+# points in the downsampled waveforms of the most recent samples
+WAVEFORM_POINTS = 1024
+# points in the per cycle snapshot waveforms
+SNAPSHOT_POINTS = 16384
+# seconds before sampling again after a bad reply
+ERROR_RETRY = 0.1
+
+# columns of the ring buffer
+TIME, VOLTS, AMPS = range(3)
+
+
+def downsample(samples: np.ndarray, points: int) -> np.ndarray:
+    """
+    Reduce samples to at most points rows by averaging equal sized blocks
+    """
+    if len(samples) <= points:
+        return samples
+    block = -(-len(samples) // points)
+    # drop the oldest samples so the newest are a whole number of blocks
+    samples = samples[len(samples) % block :]
+    return samples.reshape(-1, block, samples.shape[1]).mean(axis=1)
+
+
+class RingBuffer(object):
+    """
+    A preallocated array of (time, volts, mA) rows that overwrites its oldest
+    rows once full
+    """
+
+    def __init__(self, size: int = CAPTURE_SAMPLES):
+        self.data = np.zeros((size, 3))
+        # total rows ever appended, the next row goes at written % size
+        self.written = 0
+
+    def __len__(self) -> int:
+        return min(self.written, len(self.data))
+
+    def append(self, timestamp: float, volts: float, amps: float):
+        self.data[self.written % len(self.data)] = (timestamp, volts, amps)
+        self.written += 1
+
+    def extend(self, rows: np.ndarray):
+        rows = rows[-len(self.data) :]
+        index = np.arange(self.written, self.written + len(rows)) % len(self.data)
+        self.data[index] = rows
+        self.written += len(rows)
+
+    def since(self, written: int) -> np.ndarray:
+        """
+        A copy of the rows appended after the buffer had written rows, oldest
+        first, limited to the rows that have not yet been overwritten
+        """
+        count = min(self.written - written, len(self))
+        index = np.arange(self.written - count, self.written) % len(self.data)
+        return self.data[index]
+
+    def latest(self, count: int) -> np.ndarray:
+        return self.since(self.written - count)
+
+
+class Capture(object):
+    """
+    Collects samples from the Keithley into a RingBuffer
+
+    Normally samples are added by the IOC update loop. While armed, for
+    example during a depolarisation cycle, a worker polls the instrument
+    back to back so that the sample rate is as high as the link allows.
+    Ramp setpoints still take priority over these readback queries.
+    Bad replies are passed to on_error, which recovers the link.
+    """
+
+    def __init__(
+        self,
+        k: Keithley,
+        on_error: Optional[Callable[[ResponseError], None]] = None,
+        size: int = CAPTURE_SAMPLES,
+    ):
+        self.k = k
+        self.on_error = on_error
+        self.ring = RingBuffer(size)
+        self.armed = False
+        self.armed_at = 0
+        self.start_time = 0.0
+        self.state = 0
+
+    def add(self, volts: float, amps: float):
+        self.ring.append(monotonic(), volts, amps)
+
+    def add_trace(self):
+        """
+        Add the readings from the last sweep or trace_hold, using the
+        instrument's timestamps relative to when its trigger model started
+        """
+        readings = self.k.trace_readings
+        if len(readings) == 0:
+            return
+        times = self.k.trace_start + readings[:, 2] - readings[0, 2]
+        self.ring.extend(np.column_stack((times, readings[:, :2])))
+
+    def arm(self):
+        """
+        Start sampling at full rate and mark the start of a snapshot
+        """
+        self.armed_at = self.ring.written
+        self.start_time = monotonic()
+        if not self.armed:
+            self.armed = True
+            cothread.Spawn(self.sample_worker)
+
+    def disarm(self) -> np.ndarray:
+        """
+        Stop sampling at full rate and return the samples since arm()
+        """
+        self.armed = False
+        return self.ring.since(self.armed_at)
+
+    def sample_worker(self):
+        while self.armed:
+            # the instrument does not answer queries during a sweep
+            if self.k.sweeping:
+                cothread.Sleep(0.1)
+                continue
+            try:
+                volts, amps, self.state = self.k.get_readbacks()
+                self.add(volts, amps)
+            except ResponseError as e:
+                if self.on_error is None:
+                    print("bad reply", e)
+                else:
+                    self.on_error(e)
+                cothread.Sleep(ERROR_RETRY)
+            except Exception as e:
+                # it would fail the same way on every sample, so leave the
+                # polling to the update loop
+                print("capture stopped:", e)
+                self.armed = False
+
+    def latest(self):
+        """
+        The most recent (volts, mA, output state)
+        """
+        _, volts, amps = self.ring.latest(1)[-1]
+        return volts, amps, self.state
+
+    def waveform(self, points: int = WAVEFORM_POINTS) -> np.ndarray:
+        """
+        Downsampled ring contents with times relative to the newest sample
+        """
+        samples = downsample(self.ring.latest(len(self.ring)), points)
+        samples[:, TIME] -= samples[-1, TIME] if len(samples) else 0
+        return samples
+
+    def snapshot(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Samples from a cycle with times relative to its start, downsampled if
+        the cycle was too long to fit in SNAPSHOT_POINTS
+        """
+        samples = downsample(samples, SNAPSHOT_POINTS)
+        samples[:, TIME] -= self.start_time
+        return samples
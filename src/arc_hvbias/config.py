@@ -0,0 +1,62 @@
+"""
+Configuration of the Keithley supplies served by one IOC process
+
+Each section of an INI style configuration file describes one instrument
+and is named by its PV prefix, e.g.
+
+    [BL15J-EA-HV-01]
+    port = /dev/ttyS0
+    baud = 34800
+
+    [BL15J-EA-HV-02]
+    port = /dev/ttyS1
+    idle_pv = BL15J-EA-DET-02:ACQUIRING
+    log_dir = /var/log/hvbias
+
+where idle_pv optionally names the PV that is non zero while the detector
+powered by the supply is acquiring, and log_dir a directory in which to log
+its readbacks.
+"""
+
+from configparser import ConfigParser
+from typing import List, NamedTuple
+
+DEFAULT_PREFIX = "BL15J-EA-HV-01"
+DEFAULT_PORT = "/dev/ttyS0"
+DEFAULT_BAUD = 34800
+
+
+class Instrument(NamedTuple):
+    """
+    The serial connection and PV prefix of one Keithley supply
+    """
+
+    port: str = DEFAULT_PORT
+    baud: int = DEFAULT_BAUD
+    prefix: str = DEFAULT_PREFIX
+    idle_pv: str = ""
+    log_dir: str = ""
+
+
+def load_config(path: str) -> List[Instrument]:
+    parser = ConfigParser()
+    if not parser.read(path):
+        raise ValueError(f"Cannot read configuration file {path}")
+
+    instruments = [
+        Instrument(
+            port=section.get("port", DEFAULT_PORT),
+            baud=section.getint("baud", DEFAULT_BAUD),
+            prefix=prefix,
+            idle_pv=section.get("idle_pv", ""),
+            log_dir=section.get("log_dir", ""),
+        )
+        for prefix, section in parser.items()
+        if prefix != parser.default_section
+    ]
+    if not instruments:
+        raise ValueError(f"No instruments configured in {path}")
+    ports = [instrument.port for instrument in instruments]
+    if len(set(ports)) != len(ports):
+        raise ValueError(f"Serial ports are shared between instruments in {path}")
+    return instruments
@@ -0,0 +1,949 @@
+"""
+The records and control logic for a single Keithley HV bias supply
+"""
+
+import math
+from datetime import datetime
+from pathlib import Path
+from time import monotonic
+from typing import TYPE_CHECKING, Callable, Optional, Tuple
+
+import cothread
+from softioc import builder
+
+from .capture import SNAPSHOT_POINTS, WAVEFORM_POINTS, Capture
+from .config import Instrument
+from .keithley import Keithley, RampEngine
+from .logger import Logger
+from .metrics import (
+    HISTORY_LENGTH,
+    PHASES,
+    CycleHistory,
+    CycleMetrics,
+    CycleRecorder,
+    Outcome,
+)
+from .planner import CyclePlan, CycleSettings, Verdict, compile_cycle, plan_cycle
+from .profiler import PERCENTILES, CommandClass
+from .profiles import RampProfile
+from .publish import Publisher
+from .response import ResponseError
+from .state import DEFAULT_SETTLE_TIME, DEFAULT_TOLERANCE, BiasState, StateTracker
+from .status import Status
+from .supervisor import LinkSupervisor
+from .trend import TrendEstimator
+from .trigger import IdleTrigger
+
+if TYPE_CHECKING:
+    from .scheduler import Barrier
+
+# readbacks cost a round trip for the setpoint and output state, and with the
+# output on a second for a triggered reading of the current, some tens of ms
+# in all at the default baud rate, so polling at 10 Hz leaves most of the link
+# to ramps
+UPDATE_PERIOD = 0.1
+# default poll rates in Hz during ramps, limited further by the link latency,
+# and while holding at bias
+FAST_POLL_RATE = 50.0
+SLOW_POLL_RATE = 1.0
+# the slowest poll rate that can be configured
+MIN_POLL_RATE = 0.1
+# default minimum seconds between depolarisations started in idle gaps
+IDLE_MIN_SINCE = 60
+# default seconds of leakage current fitted, and the drift in percent over
+# that window which indicates the sensor is polarising
+TREND_WINDOW = 300.0
+TREND_THRESHOLD = 5.0
+# the STATUS shown for each BiasState when no cycle or ramp is running
+RESTING_STATUS = {
+    BiasState.OUTPUT_OFF: Status.VOLTAGE_OFF,
+    BiasState.AT_OFF: Status.VOLTAGE_OFF,
+    BiasState.BETWEEN: Status.HOLD,
+    BiasState.AT_ON: Status.VOLTAGE_ON,
+}
+# states in which the readbacks are polled as fast as possible
+FAST_POLL_STATES = (Status.RAMP_UP, Status.RAMP_DOWN)
+# how often the latency percentile PVs are refreshed
+PROFILE_PERIOD = 10.0
+# how often the downsampled capture waveforms are refreshed
+WAVEFORM_PERIOD = 1.0
+# how often the cycle plan is refreshed from the settings and link latency
+PLAN_PERIOD = 1.0
+# default deadbands of the voltage (Volts) and current (percent) readbacks
+VOLTAGE_DEADBAND = 0.01
+CURRENT_DEADBAND = 1.0
+# (name suffix, units) of the capture waveforms in column order
+WAVEFORMS = [("TIME", "Sec"), ("VOLTAGE", "Volts"), ("CURRENT", "mA")]
+# (CycleMetrics field, units) of the cycle history waveforms
+HISTORY_WAVEFORMS = [
+    ("start", "Sec"),
+    ("duration", "Sec"),
+    ("peak_current", "mA"),
+    ("charge", "mC"),
+    ("steps", ""),
+    ("outcome", ""),
+]
+
+
+class HvBias:
+    """
+    The PVs to control and monitor one Keithley, with its update loop and
+    depolarisation cycle control
+    """
+
+    def __init__(self, instrument: Instrument):
+        self.instrument = instrument
+
+        # the Keithley is connected via serial by the update loop, so that the
+        # records are served while it is unavailable
+        self.k = Keithley(instrument.port, instrument.baud)
+        self.supervisor = LinkSupervisor(self.k, self.link_changed)
+        self.capture = Capture(self.k, self.link_error)
+        self.logger = (
+            Logger(instrument.log_dir, instrument.prefix)
+            if instrument.log_dir
+            else None
+        )
+
+        # Set the record prefix
+        builder.SetDeviceName(instrument.prefix)
+
+        # Create some output records (for IOC readouts)
+        self.cmd_ramp_off = builder.boolOut(
+            "RAMP-OFF", always_update=True, on_update=self.do_ramp_off
+        )
+        self.cmd_ramp_on = builder.boolOut(
+            "RAMP-ON", always_update=True, on_update=self.do_ramp_on
+        )
+        self.cmd_cycle = builder.boolOut(
+            "CYCLE", always_update=True, on_update=self.do_start_cycle
+        )
+        self.cmd_stop = builder.boolOut(
+            "STOP", always_update=True, on_update=self.do_stop
+        )
+        self.cmd_voltage = builder.aOut(
+            "VOLTAGE", always_update=True, on_update=self.k.set_voltage
+        )
+        self.cmd_off = builder.aOut(
+            "OFF", always_update=True, on_update=self.k.source_off
+        )
+        self.cmd_on = builder.aOut("ON", always_update=True, on_update=self.k.source_on)
+
+        # polled readbacks are only posted when they change
+        self.publisher = Publisher()
+        self.voltage_rbv = self.publisher.add(
+            builder.aIn("VOLTAGE_RBV", EGU="Volts"), absolute=VOLTAGE_DEADBAND
+        )
+        self.current_rbv = self.publisher.add(
+            builder.aIn("CURRENT_RBV", EGU="mA", PREC=4),
+            relative=CURRENT_DEADBAND / 100,
+        )
+        self.output_rbv = self.publisher.add(builder.mbbIn("OUTPUT_RBV", "OFF", "ON"))
+        self.status_rbv = builder.mbbIn("STATUS", *Status.__members__)
+        self.healthy_rbv = self.publisher.add(
+            builder.mbbIn("HEALTHY_RBV", "UNHEALTHY", "HEALTHY")
+        )
+        self.cycle_rbv = builder.mbbIn("CYCLE_RBV", "IDLE", "RUNNING")
+        self.bias_state_rbv = self.publisher.add(
+            builder.mbbIn("BIAS-STATE", *BiasState.__members__)
+        )
+        self.time_since_rbv = self.publisher.add(
+            builder.longIn("TIME-SINCE", EGU="Sec")
+        )
+        self.poll_rate_rbv = self.publisher.add(
+            builder.aIn("POLL-RATE_RBV", EGU="Hz", PREC=1)
+        )
+        self.voltage_deadband = builder.aOut(
+            "VOLTAGE-DEADBAND",
+            initial_value=VOLTAGE_DEADBAND,
+            EGU="Volts",
+            PREC=3,
+            on_update=self.set_voltage_deadband,
+        )
+        self.current_deadband = builder.aOut(
+            "CURRENT-DEADBAND",
+            initial_value=CURRENT_DEADBAND,
+            EGU="%",
+            PREC=2,
+            on_update=self.set_current_deadband,
+        )
+        self.response_errors_rbv = builder.longIn("RESPONSE-ERRORS")
+        self.connected_rbv = builder.mbbIn("CONNECTED_RBV", "DISCONNECTED", "CONNECTED")
+        self.link_timeouts_rbv = self.publisher.add(builder.longIn("LINK-TIMEOUTS"))
+        self.link_resyncs_rbv = self.publisher.add(builder.longIn("LINK-RESYNCS"))
+        self.link_reconnects_rbv = self.publisher.add(builder.longIn("LINK-RECONNECTS"))
+        self.link_uptime_rbv = self.publisher.add(
+            builder.longIn("LINK-UPTIME", EGU="Sec")
+        )
+
+        # software current interlock and how quickly aborts take effect
+        self.k.on_trip = self.interlock_tripped
+        self.current_limit = builder.aOut(
+            "CURRENT-LIMIT", EGU="mA", PREC=4, on_update=self.set_current_limit
+        )
+        self.cmd_interlock_reset = builder.boolOut(
+            "INTERLOCK-RESET", always_update=True, on_update=self.do_interlock_reset
+        )
+        self.interlock_rbv = builder.mbbIn("INTERLOCK_RBV", "OK", "TRIPPED")
+        self.trip_current_rbv = builder.aIn("TRIP-CURRENT", EGU="mA", PREC=4)
+        # the time taken to write :ABORT for STOP
+        self.stop_latency_rbv = builder.aIn("STOP-LATENCY", EGU="ms", PREC=2)
+        # the time from a trip until the output was confirmed off
+        self.trip_latency_rbv = builder.aIn("TRIP-LATENCY", EGU="ms", PREC=2)
+        self.trip_latency_max_rbv = builder.aIn("TRIP-LATENCY-MAX", EGU="ms", PREC=2)
+        self.abort_bound_rbv = builder.aIn("ABORT-BOUND", EGU="ms", PREC=2)
+        self.trip_latency_max = 0.0
+
+        # serial link latency profile
+        self.cmd_profile = builder.boolOut(
+            "PROFILE", always_update=True, on_update=self.do_profile
+        )
+        self.cmd_profile_dump = builder.boolOut(
+            "PROFILE-DUMP", always_update=True, on_update=self.do_profile_dump
+        )
+        self.latency_rbv = {
+            (command_class, pct): builder.aIn(
+                f"{command_class.name}-P{pct}", EGU="ms", PREC=2
+            )
+            for command_class in CommandClass
+            for pct in PERCENTILES
+        }
+
+        # captured samples, the latest downsampled and a snapshot of each cycle
+        self.waveform_rbv = [
+            builder.WaveformIn(
+                "WAVEFORM-" + name, length=WAVEFORM_POINTS, datatype=float, EGU=egu
+            )
+            for name, egu in WAVEFORMS
+        ]
+        self.snapshot_rbv = [
+            builder.WaveformIn(
+                "SNAPSHOT-" + name, length=SNAPSHOT_POINTS, datatype=float, EGU=egu
+            )
+            for name, egu in WAVEFORMS
+        ]
+
+        # create some input records (for IOC inputs)
+        self.on_setpoint = builder.aOut("ON-SETPOINT", initial_value=500, EGU="Volts")
+        self.off_setpoint = builder.aOut("OFF-SETPOINT", EGU="Volts")
+        self.rise_time = builder.aOut("RISE-TIME", initial_value=2, EGU="Sec", PREC=2)
+        self.hold_time = builder.aOut("HOLD-TIME", initial_value=3, EGU="Sec", PREC=2)
+        self.fall_time = builder.aOut("FALL-TIME", initial_value=2, EGU="Sec", PREC=2)
+        self.pause_time = builder.aOut("PAUSE-TIME", EGU="Sec", PREC=2)
+        self.repeats = builder.longOut("REPEATS", initial_value=1)
+        self.step_size = builder.aOut("STEP-SIZE", initial_value=5.0)
+        self.max_time = builder.longOut("MAX-TIME", initial_value=900)
+        self.ramp_engine = builder.mbbOut(
+            "RAMP-ENGINE", *RampEngine.__members__, on_update=self.set_ramp_engine
+        )
+        self.ramp_profile = builder.mbbOut(
+            "RAMP-PROFILE", *RampProfile.__members__, on_update=self.set_ramp_profile
+        )
+        self.trace_hold = builder.boolOut("TRACE-HOLD", ZNAM="POLL", ONAM="TRACE")
+        self.cycle_engine = builder.boolOut("CYCLE-ENGINE", ZNAM="HOST", ONAM="LIST")
+
+        # classify the output with a tolerance, accepting changes once settled
+        self.tracker = StateTracker()
+        self.tolerance = builder.aOut(
+            "TOLERANCE",
+            initial_value=DEFAULT_TOLERANCE,
+            EGU="Volts",
+            PREC=2,
+            on_update=self.set_tolerance,
+        )
+        self.settle_time = builder.aOut(
+            "SETTLE-TIME",
+            initial_value=DEFAULT_SETTLE_TIME,
+            EGU="Sec",
+            PREC=2,
+            on_update=self.set_settle_time,
+        )
+
+        # cycle in the gaps between detector acquisitions
+        self.trigger = IdleTrigger(
+            lambda: self.plan().duration,
+            self.idle_cycle_permitted,
+            self.request_cycle,
+        )
+        self.idle_pv = builder.stringOut(
+            "IDLE-PV", initial_value=instrument.idle_pv, on_update=self.trigger.connect
+        )
+        self.idle_min_since = builder.longOut(
+            "IDLE-MIN-SINCE", initial_value=IDLE_MIN_SINCE, EGU="Sec"
+        )
+        self.acquiring_rbv = self.publisher.add(
+            builder.mbbIn("ACQUIRING_RBV", "IDLE", "ACQUIRING")
+        )
+        self.predicted_gap_rbv = self.publisher.add(
+            builder.aIn("PREDICTED-GAP", EGU="Sec", PREC=1)
+        )
+        self.idle_cycles_rbv = self.publisher.add(builder.longIn("IDLE-CYCLES"))
+        self.trigger.connect(instrument.idle_pv)
+
+        # the expected cycle with the present settings, and how the last went
+        self.plan_duration_rbv = self.publisher.add(
+            builder.aIn("PLAN-DURATION", EGU="Sec", PREC=2), absolute=0.01
+        )
+        self.plan_step_rate_rbv = self.publisher.add(
+            builder.aIn("PLAN-STEP-RATE", EGU="Hz", PREC=1), absolute=0.1
+        )
+        self.plan_step_size_rbv = self.publisher.add(
+            builder.aIn("PLAN-STEP-SIZE", EGU="Volts", PREC=2)
+        )
+        self.plan_verdict_rbv = self.publisher.add(
+            builder.mbbIn("PLAN-VERDICT", *Verdict.__members__)
+        )
+        self.plan_message_rbv = builder.stringIn("PLAN-MESSAGE")
+        self.cycle_duration_rbv = builder.aIn("CYCLE-DURATION", EGU="Sec", PREC=2)
+        self.cycle_predicted_rbv = builder.aIn("CYCLE-PREDICTED", EGU="Sec", PREC=2)
+        self.cycle_overrun_rbv = builder.aIn("CYCLE-OVERRUN", EGU="Sec", PREC=2)
+
+        # measurements of the last cycle, and of the recent ones as waveforms
+        self.recorder: Optional[CycleRecorder] = None
+        self.history = CycleHistory()
+        self.cycle_start_rbv = builder.stringIn("CYCLE-START")
+        self.cycle_end_rbv = builder.stringIn("CYCLE-END")
+        self.cycle_phase_rbv = {
+            status: builder.aIn(
+                f"CYCLE-{status.name.replace('_', '-')}-TIME", EGU="Sec", PREC=2
+            )
+            for status in PHASES
+        }
+        self.cycle_peak_current_rbv = builder.aIn(
+            "CYCLE-PEAK-CURRENT", EGU="mA", PREC=4
+        )
+        self.cycle_charge_rbv = builder.aIn("CYCLE-CHARGE", EGU="mC", PREC=6)
+        self.cycle_steps_rbv = builder.longIn("CYCLE-STEPS")
+        self.cycle_outcome_rbv = builder.mbbIn("CYCLE-OUTCOME", *Outcome.__members__)
+        self.history_rbv = {
+            name: builder.WaveformIn(
+                "HISTORY-" + name.upper().replace("_", "-"),
+                length=HISTORY_LENGTH,
+                datatype=float,
+                EGU=egu,
+            )
+            for name, egu in HISTORY_WAVEFORMS
+        }
+        self.history_count_rbv = builder.longIn("HISTORY-COUNT")
+        self.cmd_history_export = builder.boolOut(
+            "HISTORY-EXPORT", always_update=True, on_update=self.do_history_export
+        )
+
+        # cycle when the leakage current drifts, rather than only on MAX-TIME
+        self.trend = TrendEstimator(TREND_WINDOW)
+        self.trend_enable = builder.boolOut("TREND-ENABLE", ZNAM="OFF", ONAM="ON")
+        self.trend_window = builder.aOut(
+            "TREND-WINDOW",
+            initial_value=TREND_WINDOW,
+            EGU="Sec",
+            on_update=self.set_trend_window,
+        )
+        self.trend_threshold = builder.aOut(
+            "TREND-THRESHOLD", initial_value=TREND_THRESHOLD, EGU="%", PREC=2
+        )
+        self.trend_slope_rbv = self.publisher.add(
+            builder.aIn("TREND-SLOPE", EGU="mA/s", PREC=9), relative=0.01
+        )
+        self.trend_drift_rbv = self.publisher.add(
+            builder.aIn("TREND-DRIFT", EGU="%", PREC=2), absolute=0.01
+        )
+        self.trend_cycles_rbv = self.publisher.add(builder.longIn("TREND-CYCLES"))
+        self.trend_cycles = 0
+
+        # rows logged to disk, and lost because the disk could not keep up
+        self.log_rows_rbv = self.publisher.add(builder.longIn("LOG-ROWS"))
+        self.log_dropped_rbv = self.publisher.add(builder.longIn("LOG-DROPPED"))
+        self.log_errors_rbv = self.publisher.add(builder.longIn("LOG-ERRORS"))
+        self.fast_poll_rate = builder.aOut(
+            "POLL-RATE-FAST", initial_value=FAST_POLL_RATE, EGU="Hz", PREC=1
+        )
+        self.slow_poll_rate = builder.aOut(
+            "POLL-RATE-SLOW", initial_value=SLOW_POLL_RATE, EGU="Hz", PREC=1
+        )
+
+        # other state variables
+        self.last_time = datetime.now()
+        self.last_transition = datetime.now()
+        self.last_profile = datetime.now()
+        self.last_waveform = datetime.now()
+        self.last_plan = datetime.now()
+        self.abort_flag = False
+        # True while a cycle or manual ramp is changing the voltage
+        self.ramping = False
+        self.status = Status.VOLTAGE_OFF
+        # signalled on a change of status to cut short a slow poll
+        self.status_changed = cothread.Event()
+        # set by the CycleScheduler to keep the phases of a simultaneous cycle
+        # in step with other devices
+        self.barrier: Optional["Barrier"] = None
+        # set by the CycleScheduler to queue the cycles that this device calls
+        # for by itself, so that they respect its CONCURRENCY
+        self.on_cycle_due: Optional[Callable[["HvBias"], None]] = None
+        # the reason and settings of the last refused cycle, so that a cycle
+        # called for on every poll is not reported as refused every time
+        self.refusal: Optional[Tuple[str, CycleSettings]] = None
+        # count of completed update loop iterations
+        self.updates = 0
+        # set while the Keithley is connected
+        self.link_up = cothread.Event(auto_reset=False)
+
+    # main update loop
+    def update(self):
+        self.supervisor.connect()
+        while not self.supervisor.closed:
+            try:
+                # the instrument does not answer queries during a sweep
+                if self.k.sweeping:
+                    self.publisher.flush()
+                    self.wait_poll(UPDATE_PERIOD)
+                    continue
+
+                if self.capture.armed and len(self.capture.ring):
+                    # the capture is already polling as fast as it can
+                    volts, amps, state = self.capture.latest()
+                else:
+                    volts, amps, state = self.k.get_readbacks()
+                    self.capture.add(volts, amps)
+                self.voltage_rbv.set(volts)
+                self.current_rbv.set(amps)
+                self.output_rbv.set(state)
+                if self.logger is not None:
+                    self.logger.log(volts, amps, state, self.status)
+                    self.log_rows_rbv.set(self.logger.rows_written)
+                    self.log_dropped_rbv.set(self.logger.rows_dropped)
+                    self.log_errors_rbv.set(self.logger.write_errors)
+
+                # calculate housekeeping readbacks
+                now = datetime.now()
+                bias_state = self.tracker.update(
+                    monotonic(),
+                    volts,
+                    state,
+                    self.on_setpoint.get(),
+                    self.off_setpoint.get(),
+                )
+                healthy = bias_state == BiasState.AT_ON
+                self.healthy_rbv.set(healthy)
+                # cycles and ramps show their own progress on STATUS
+                if bias_state != self.bias_state_rbv.get() and not (
+                    self.ramping or self.cycle_rbv.get() or self.status == Status.ERROR
+                ):
+                    self.set_status(RESTING_STATUS[bias_state])
+                self.bias_state_rbv.set(bias_state)
+
+                # an unbiased sensor depolarises as well as one at the off voltage
+                if bias_state in (BiasState.AT_OFF, BiasState.OUTPUT_OFF):
+                    self.last_time = now
+                since = (now - self.last_time).total_seconds()
+                self.time_since_rbv.set(int(since))
+                self.acquiring_rbv.set(self.trigger.acquiring)
+                self.predicted_gap_rbv.set(self.trigger.predictor.predict() or 0.0)
+                self.idle_cycles_rbv.set(self.trigger.triggered)
+                self.link_timeouts_rbv.set(self.k.transport.timeouts)
+                self.link_uptime_rbv.set(int(self.supervisor.uptime))
+                period = self.poll_period()
+                self.poll_rate_rbv.set(1 / period)
+                self.publisher.flush()
+
+                # if max time exceeded since last depolarise then force a cycle
+                if since > self.max_time.get():
+                    self.request_cycle()
+
+                self.update_trend(healthy, amps)
+
+                if (now - self.last_profile).total_seconds() > PROFILE_PERIOD:
+                    self.publish_profile()
+
+                if (now - self.last_waveform).total_seconds() > WAVEFORM_PERIOD:
+                    self.publish_waveform()
+
+                if (now - self.last_plan).total_seconds() > PLAN_PERIOD:
+                    self.plan()
+
+                self.updates += 1
+
+                self.wait_poll(period)
+            except ResponseError as e:
+                self.link_error(e)
+                cothread.Sleep(UPDATE_PERIOD)
+
+    def link_error(self, e: ResponseError):
+        """
+        The device returned an error string, a garbled reply or none at all,
+        get the link working again before the next poll
+        """
+        self.response_errors_rbv.set(self.response_errors_rbv.get() + 1)
+        print("bad reply", e)
+        self.supervisor.recover(e)
+        self.link_resyncs_rbv.set(self.supervisor.resyncs)
+        self.link_reconnects_rbv.set(self.supervisor.reconnects)
+
+    def close(self):
+        """
+        Stop the update loop and the capture, and close the port
+        """
+        self.capture.armed = False
+        self.supervisor.close()
+
+    def link_changed(self, up: bool):
+        self.connected_rbv.set(up)
+        if up:
+            self.link_up.Signal()
+        else:
+            self.link_up.Reset()
+            self.link_uptime_rbv.set(0)
+            self.publisher.flush()
+
+    def poll_period(self) -> float:
+        """
+        The update period for the present status: as fast as the link allows
+        while ramping, slowly while holding at bias and otherwise the default
+
+        While ramping the period is no shorter than the longest the readbacks
+        have taken with the output on, so that polling leaves the link idle
+        at least half the time for the ramp's setpoints.
+        """
+        if self.status in FAST_POLL_STATES:
+            rate = max(self.fast_poll_rate.get(), MIN_POLL_RATE)
+            readbacks = max(self.k.readback_max, self.k.latency(CommandClass.COMPOUND))
+            return max(1 / rate, readbacks)
+        if self.status == Status.VOLTAGE_ON:
+            return 1 / max(self.slow_poll_rate.get(), MIN_POLL_RATE)
+        return UPDATE_PERIOD
+
+    def slowest_poll_period(self) -> float:
+        """
+        The longest update period of any status with the present poll rates
+        """
+        fast = 1 / max(self.fast_poll_rate.get(), MIN_POLL_RATE)
+        slow = 1 / max(self.slow_poll_rate.get(), MIN_POLL_RATE)
+        return max(fast, slow, UPDATE_PERIOD)
+
+    def wait_poll(self, period: float):
+        """
+        Sleep until the next poll, waking early if the status changes
+        """
+        try:
+            self.status_changed.Wait(period)
+        except cothread.Timedout:
+            pass
+
+    def set_status(self, status: Status):
+        self.status_rbv.set(status)
+        if status != self.status:
+            self.status = status
+            self.status_changed.Signal()
+            if self.recorder is not None:
+                self.recorder.enter(status)
+            # log the transition with the latest readbacks
+            if self.logger is not None and self.voltage_rbv.get() is not None:
+                self.logger.log(
+                    self.voltage_rbv.get(),
+                    self.current_rbv.get(),
+                    self.output_rbv.get(),
+                    status,
+                )
+
+    def do_start_cycle(self, do: int):
+        if do == 1 and not self.cycle_rbv.get():
+            cothread.Spawn(self.cycle_control)
+
+    def request_cycle(self):
+        """
+        Start a cycle called for by MAX-TIME, an idle gap or the leakage
+        trend, through the scheduler if there is one
+        """
+        if self.on_cycle_due is not None:
+            self.on_cycle_due(self)
+        else:
+            self.do_start_cycle(1)
+
+    def cycle_control(self):
+        """
+        Continuously perform a depolarisation cycle when the detector is idle
+        or after max time
+        """
+        if not self.k.connected:
+            self.refuse("not connected")
+            return
+        if self.k.tripped:
+            # STATUS stays at ERROR until INTERLOCK-RESET
+            self.refuse("interlock tripped")
+            return
+        plan = self.plan()
+        if plan.verdict == Verdict.REFUSED:
+            self.refuse(plan.message)
+            return
+        elif plan.verdict == Verdict.WARNING:
+            print("cycle warning", plan.message)
+
+        self.refusal = None
+        start = monotonic()
+        self.abort_flag = False
+        self.capture.arm()
+        recorder = self.recorder = CycleRecorder(self.k.steps_sent)
+        failed = False
+
+        try:
+            self.cycle_rbv.set(True)
+            if self.cycle_engine.get():
+                self.list_cycle()
+            else:
+                self.host_cycle()
+
+        except Exception as e:
+            print("cycle failed", e, self.k.last_recv)
+            failed = True
+
+        finally:
+            self.cycle_rbv.set(False)
+            self.leave_barrier()
+            samples = self.capture.disarm()
+            if failed:
+                outcome = Outcome.FAILED
+            elif self.k.tripped:
+                outcome = Outcome.INTERLOCK
+            elif self.abort_flag:
+                outcome = Outcome.STOPPED
+            else:
+                outcome = Outcome.COMPLETED
+            # the interlock shows ERROR until it is reset, otherwise a cycle
+            # cut short shows where the bias was last seen to be
+            if outcome in (Outcome.FAILED, Outcome.STOPPED):
+                self.set_status(RESTING_STATUS.get(self.tracker.state, Status.HOLD))
+            self.publish_metrics(recorder.finish(samples, self.k.steps_sent, outcome))
+            self.recorder = None
+            self.publish_snapshot(samples)
+            duration = monotonic() - start
+            self.cycle_duration_rbv.set(duration)
+            self.cycle_predicted_rbv.set(plan.duration)
+            self.cycle_overrun_rbv.set(duration - plan.duration)
+
+    def host_cycle(self):
+        """
+        Make each ramp and hold of the cycle in turn
+        """
+        # initially move to a bias-on state
+        # self.status_rbv.set(Status.RAMP_DOWN)
+        self.synchronise()
+        self.ramp(self.on_setpoint.get(), self.fall_time.get())
+
+        for repeat in range(self.repeats.get()):
+            if self.abort_flag:
+                break
+            self.set_status(Status.VOLTAGE_ON)
+            if repeat > 0:
+                self.synchronise()
+                self.hold(self.hold_time.get())
+
+            self.synchronise()
+            self.set_status(Status.RAMP_UP)
+            self.ramp(self.off_setpoint.get(), self.rise_time.get())
+            if self.abort_flag:
+                break
+
+            self.synchronise()
+            self.set_status(Status.VOLTAGE_OFF)
+            self.hold(self.hold_time.get())
+            if self.abort_flag:
+                break
+
+            self.synchronise()
+            self.set_status(Status.RAMP_DOWN)
+            self.ramp(self.on_setpoint.get(), self.fall_time.get())
+            if self.abort_flag:
+                break
+        else:
+            self.set_status(Status.VOLTAGE_ON)
+
+    def list_cycle(self):
+        """
+        Run the whole cycle from the source list, reading back what was
+        measured once it has finished
+        """
+        sequence = compile_cycle(
+            self.settings(), self.k.get_voltage(), min_interval=self.k.reading_time()
+        )
+        self.synchronise()
+        # the list keeps to the same times as the other devices' cycles once
+        # started together, so they go on without waiting for it at each phase
+        self.leave_barrier()
+        # run_sequence clears the abort for the instrument, so a STOP while
+        # compiling or waiting for the other devices must be seen here
+        if self.abort_flag:
+            return
+        self.set_status(Status.LIST_CYCLE)
+        self.ramping = True
+        try:
+            self.k.run_sequence(sequence.volts, sequence.delay)
+        finally:
+            self.ramping = False
+        self.capture.add_trace()
+        if not self.abort_flag:
+            # readbacks are not polled while the list runs, so the time at the
+            # off voltage was not seen by the update loop
+            self.last_time = datetime.now()
+            self.set_status(Status.VOLTAGE_ON)
+
+    def settings(self) -> CycleSettings:
+        return CycleSettings(
+            on_volts=self.on_setpoint.get(),
+            off_volts=self.off_setpoint.get(),
+            rise_time=self.rise_time.get(),
+            hold_time=self.hold_time.get(),
+            fall_time=self.fall_time.get(),
+            repeats=self.repeats.get(),
+            step_size=self.step_size.get(),
+            trace_hold=bool(self.trace_hold.get()),
+            ramp_profile=RampProfile(self.ramp_profile.get()),
+            list_cycle=bool(self.cycle_engine.get()),
+        )
+
+    def plan(self) -> CyclePlan:
+        """
+        Plan a cycle from the present voltage and publish what to expect
+        """
+        self.last_plan = datetime.now()
+        plan = plan_cycle(self.k, self.settings(), self.voltage_rbv.get() or 0.0)
+        self.plan_duration_rbv.set(plan.duration)
+        self.plan_step_rate_rbv.set(plan.step_rate)
+        self.plan_step_size_rbv.set(plan.step_size)
+        self.plan_verdict_rbv.set(plan.verdict)
+        if plan.message != self.plan_message_rbv.get():
+            self.plan_message_rbv.set(plan.message)
+        return plan
+
+    def refuse(self, reason: str):
+        """
+        Give up on starting a cycle, reporting why unless the cycle was
+        refused for the same reason with the same settings last time
+        """
+        refusal = (reason, self.settings())
+        if refusal != self.refusal:
+            print("cycle refused,", reason)
+            self.refusal = refusal
+        self.leave_barrier()
+
+    def leave_barrier(self):
+        if self.barrier is not None:
+            self.barrier.leave()
+            self.barrier = None
+
+    def update_trend(self, healthy: bool, amps: float):
+        """
+        Fit the leakage current while holding at bias, and cycle once it has
+        drifted by more than TREND-THRESHOLD percent over a whole window
+        """
+        if not healthy or self.cycle_rbv.get():
+            # ramps and other voltages say nothing about polarisation
+            self.trend.clear()
+            return
+        self.trend.add(monotonic(), amps)
+        slope, mean = self.trend.slope(), self.trend.mean()
+        if slope is None or not mean:
+            return
+        drift = abs(slope * self.trend.window / mean) * 100
+        self.trend_slope_rbv.set(slope)
+        self.trend_drift_rbv.set(drift)
+        if (
+            self.trend_enable.get()
+            and self.trend.span >= self.trend.window
+            and drift > self.trend_threshold.get()
+        ):
+            self.trend_cycles += 1
+            self.trend_cycles_rbv.set(self.trend_cycles)
+            self.trend.clear()
+            self.request_cycle()
+
+    def set_trend_window(self, seconds: float):
+        self.trend.window = seconds
+        self.trend.clear()
+
+    def idle_cycle_permitted(self) -> bool:
+        """
+        Whether an idle gap may be used for a cycle, which it is not if one is
+        already running or there was a depolarisation too recently
+        """
+        since = (datetime.now() - self.last_time).total_seconds()
+        return not self.cycle_rbv.get() and since >= self.idle_min_since.get()
+
+    def synchronise(self):
+        """
+        Wait for the other devices in a simultaneous cycle to reach this phase
+        """
+        if self.barrier is not None:
+            self.barrier.wait()
+
+    def nominal_duration(self) -> float:
+        """
+        What the configured times of a cycle add up to, starting from the on
+        voltage. Holds come between repeats as well as at the off voltage.
+        """
+        repeats = self.repeats.get()
+        rise, hold, fall = (
+            self.rise_time.get(),
+            self.hold_time.get(),
+            self.fall_time.get(),
+        )
+        return repeats * (rise + hold + fall) + max(repeats - 1, 0) * hold
+
+    def ramp(self, to_volts: float, seconds: float):
+        """
+        Ramp with the current step size, capturing the readings of a sweep
+        """
+        self.ramping = True
+        try:
+            self.k.ramp(to_volts, self.step_size.get(), seconds)
+        finally:
+            self.ramping = False
+        if self.k.ramp_engine == RampEngine.SWEEP:
+            self.capture.add_trace()
+
+    def hold(self, seconds: float):
+        """
+        Hold the present voltage, measuring into the trace buffer if enabled
+        """
+        if self.trace_hold.get():
+            self.k.trace_hold(seconds)
+            self.capture.add_trace()
+        else:
+            cothread.Sleep(seconds)
+
+    def publish_waveform(self):
+        self.last_waveform = datetime.now()
+        samples = self.capture.waveform()
+        for column, record in enumerate(self.waveform_rbv):
+            record.set(samples[:, column])
+
+    def publish_snapshot(self, samples):
+        samples = self.capture.snapshot(samples)
+        for column, record in enumerate(self.snapshot_rbv):
+            record.set(samples[:, column])
+
+    def publish_metrics(self, metrics: CycleMetrics):
+        self.history.add(metrics)
+        self.cycle_start_rbv.set(str(datetime.fromtimestamp(metrics.start))[:19])
+        self.cycle_end_rbv.set(str(datetime.fromtimestamp(metrics.end))[:19])
+        for status, seconds in zip(PHASES, metrics.phases):
+            self.cycle_phase_rbv[status].set(seconds)
+        self.cycle_peak_current_rbv.set(metrics.peak_current)
+        self.cycle_charge_rbv.set(metrics.charge)
+        self.cycle_steps_rbv.set(metrics.steps)
+        self.cycle_outcome_rbv.set(metrics.outcome)
+        for name, record in self.history_rbv.items():
+            record.set(self.history.column(name))
+        self.history_count_rbv.set(len(self.history))
+
+    def do_history_export(self, do: int):
+        if do == 1:
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            path = Path(self.instrument.log_dir or ".") / (
+                f"{self.instrument.prefix}-cycles-{stamp}.csv"
+            )
+            try:
+                self.history.export(str(path))
+                print(f"exported {len(self.history)} cycles to {path}")
+            except OSError as e:
+                print("cycle history export failed", e)
+
+    def publish_profile(self):
+        self.last_profile = datetime.now()
+        summary = self.k.transport.profiler.summary()
+        for (command_class, pct), record in self.latency_rbv.items():
+            seconds = summary[command_class][pct]
+            if seconds is not None:
+                record.set(seconds * 1000)
+        bound = self.k.abort_bound(self.slowest_poll_period())
+        self.abort_bound_rbv.set(bound * 1000)
+
+    def do_profile(self, do: int):
+        if do == 1:
+            cothread.Spawn(self.profile_worker)
+
+    def profile_worker(self):
+        print(self.k.profile())
+        self.publish_profile()
+
+    def do_profile_dump(self, do: int):
+        if do == 1:
+            print(self.k.transport.profiler.dump())
+
+    def set_tolerance(self, volts: float):
+        self.tracker.tolerance = volts
+
+    def set_settle_time(self, seconds: float):
+        self.tracker.settle_time = seconds
+
+    def set_voltage_deadband(self, volts: float):
+        self.voltage_rbv.absolute = volts
+
+    def set_current_deadband(self, percent: float):
+        self.current_rbv.relative = percent / 100
+
+    def set_ramp_engine(self, engine: int):
+        self.k.ramp_engine = RampEngine(engine)
+
+    def set_ramp_profile(self, profile: int):
+        self.k.ramp_profile = RampProfile(profile)
+
+    def set_voltage(self, volts: str):
+        self.k.set_voltage(float(volts))
+
+    def do_stop(self, stop: int):
+        if stop == 1:
+            self.abort_flag = True
+            self.stop_latency_rbv.set(self.k.abort() * 1000)
+            self.cycle_rbv.set(0)
+            self.set_status(Status.HOLD)
+
+    def interlock_tripped(self, amps: float, latency: float):
+        """
+        Called by the Keithley once it has turned the output off because the
+        current exceeded CURRENT-LIMIT
+        """
+        self.abort_flag = True
+        self.interlock_rbv.set(1)
+        self.trip_current_rbv.set(amps)
+        self.record_trip_latency(latency)
+        self.set_status(Status.ERROR)
+        print(f"interlock tripped at {amps} mA, output off in {latency:.4f} s")
+
+    def do_interlock_reset(self, reset: int):
+        if reset == 1 and self.k.tripped:
+            self.k.tripped = False
+            self.interlock_rbv.set(0)
+            self.set_status(Status.VOLTAGE_OFF)
+
+    def set_current_limit(self, amps: float):
+        self.k.set_current_limit(amps)
+
+    def record_trip_latency(self, seconds: float):
+        if math.isinf(seconds):
+            # the instrument did not confirm that the output is off
+            return
+        self.trip_latency_max = max(self.trip_latency_max, seconds)
+        self.trip_latency_rbv.set(seconds * 1000)
+        self.trip_latency_max_rbv.set(self.trip_latency_max * 1000)
+
+    def do_ramp_on(self, start: bool):
+        self.ramping = True
+        self.set_status(Status.RAMP_DOWN)
+        seconds = self.rise_time.get()
+        to_volts = self.on_setpoint.get()
+        cothread.Spawn(self.ramp_worker, to_volts, seconds, Status.VOLTAGE_ON)
+
+    def do_ramp_off(self, start: bool):
+        self.ramping = True
+        self.set_status(Status.RAMP_UP)
+        seconds = self.fall_time.get()
+        to_volts = self.off_setpoint.get()
+        cothread.Spawn(self.ramp_worker, to_volts, seconds, Status.VOLTAGE_OFF)
+
+    def ramp_worker(self, to_volts: float, seconds: float, status: Status):
+        """
+        A manually requested ramp, after which polling slows down again
+        """
+        self.abort_flag = False
+        self.ramp(to_volts, seconds)
+        if not self.abort_flag:
+            self.set_status(status)
@@ -2,17 +2,107 @@
 Defines a connection to a Kiethley 2400 over serial and provides an interface
 to command and query the device
 """
+
 import math
 from datetime import datetime
+from enum import IntEnum
+from time import monotonic
+from typing import Callable, List, Optional, Tuple
 
 import cothread
-import serial
+import numpy as np
+
+from .profiler import CommandClass
+from .profiles import RampProfile, setpoints
+from .response import (
+    DataFormat,
+    ResponseError,
+    block_size,
+    decode_ascii,
+    decode_block,
+    format_commands,
+    parse_format,
+)
+from .transport import REPLY_TIMEOUT, Priority, Transport
+
+# upper limit on the manual ramp step rate however fast the link is
+MAX_HZ = 50
+# assumed command latency until it has been measured
+MIN_LATENCY = 0.025
+# percentile of measured latencies used for ramp planning
+PLANNING_PERCENTILE = 95
+# percentile of measured latencies used to predict how long commands take
+EXPECTED_PERCENTILE = 50
+# percentile of measured latencies used for the abort bound: the largest
+# in the profiler's history, as a high percentile is not a worst case
+WORST_PERCENTILE = 100
+# a harmless command used to time setpoints without changing the output
+PROFILE_SET_COMMAND = ":SYST:BEEP:STAT 0"
+
+# compound query used to fetch the setpoint and output state in one round trip
+READBACKS_QUERY = ":SOURCE:VOLTAGE?;:OUTPUT:STATE?"
+# takes a single reading of TRACE_ELEMENTS. :SOURCE:CURRENT? would return the
+# programmed current source level, not the measured current.
+MEASURE_QUERY = ":READ?"
+# puts the trigger model back to the single reading taken by MEASURE_QUERY
+# after run_trace has set it up for many
+TRIGGER_RESET = ":TRIGGER:SEQ1:COUNT 1;:TRIGGER:SEQ1:DELAY 0"
+# the hardware current compliance is set this factor above the software
+# limit, so that it clamps the current during sweeps but the clamped current
+# still trips the software interlock
+COMPLIANCE_MARGIN = 1.1
+# the 2400 current compliance in A after *RST, restored when there is no limit
+DEFAULT_COMPLIANCE = 105e-6
+# stops the trigger model, turns the output off and confirms it in one line
+OUTPUT_OFF_COMMAND = ":ABORT;:SOURCE:CLEAR:IMMEDIATE;:OUTPUT:STATE?"
+
+# limits of the 2400 sweep, source list and trace buffer
+MAX_SWEEP_POINTS = 2500
+# values the 2400 accepts in one source list command, the rest of a list is
+# sent in further commands of up to as many values each
+LIST_CHUNK_POINTS = 100
+LIST_COMMAND = ":SOURCE:LIST:VOLTAGE"
+LIST_APPEND_COMMAND = ":SOURCE:LIST:VOLTAGE:APPEND"
+# characters sent per value in a source list, e.g. "-123.456,"
+LIST_VALUE_CHARS = 9
+# the values stored for each reading in the trace buffer, see startup_commands
+TRACE_ELEMENTS = ("VOLTAGE", "CURRENT", "TIME")
+# default interval between trace buffer readings while holding
+TRACE_INTERVAL = 0.01
+# the functions measured in each reading, see reading_time
+MEASURED_FUNCTIONS = ("CURRENT:DC", "VOLTAGE:DC")
+# integration time of each measurement in power line cycles, short enough for
+# readings every TRACE_INTERVAL at some cost in noise rejection. After *RST
+# the 2400 integrates for 1 and auto zeroes, several line cycles a reading.
+NPLC = 0.1
+# settling time before each reading, fixed rather than the 2400's auto delay
+# so that the time a reading takes is known
+SOURCE_DELAY = 0.001
+# the power line frequency in Hz until it has been read from the instrument
+LINE_FREQUENCY = 50.0
+# how often to check for an abort while waiting for a sweep to complete
+SWEEP_POLL = 0.1
+# seconds allowed for late replies to arrive before they are discarded
+RESYNC_DRAIN = 0.1
+
 
-MAX_HZ = 20
-LOOP_OVERHEAD = 0.03
+class RampEngine(IntEnum):
+    """
+    How a voltage ramp is executed, see Keithley.ramp
+    """
+
+    MANUAL = 0
+    SWEEP = 1
 
 
 class Keithley(object):
+    """
+    Commands and queries for one Keithley 2400
+
+    Nothing is sent to the instrument until connect() is called, so that an
+    IOC can serve its records while the instrument is unavailable.
+    """
+
     def __init__(
         self,
         port: str = "/dev/ttyS0",
@@ -20,75 +110,462 @@ class Keithley(object):
         bytesize: int = 8,
         parity: str = "N",
     ):
-        self.ser = serial.Serial(
-            port, baud, bytesize=bytesize, parity=parity, timeout=1
-        )
+        self.transport = Transport(port, baud, bytesize=bytesize, parity=parity)
 
         self.sweep_start = datetime.now()
         self.sweep_seconds = 0.0
+        self.tracing = False
+        # held by get_readbacks, and by run_trace from before it sets up the
+        # trigger model until the readings are read back, so that no readback
+        # reaches the instrument in between
+        self.readback_lock = cothread.RLock()
+        # rows of (volts, mA, seconds) from the last sweep or trace_hold
+        self.trace_readings = np.zeros((0, 3))
+        self.trace_start = monotonic()
+        # (scheduled, actual) seconds into the last manual ramp of each step
+        self.step_times: List[Tuple[float, float]] = []
+        # ramp setpoints sent, or stepped through by the instrument, so far
+        self.steps_sent = 0
+        self.ramp_engine = RampEngine.MANUAL
+        self.ramp_profile = RampProfile.LINEAR
         self.abort_flag = False
+        # wakes ramp and trace waits as soon as there is an abort
+        self.abort_event = cothread.Event(auto_reset=False)
 
-        # Check the connection
-        self.send_recv("")
-        self.send_recv("*RST")
-        model = self.send_recv("*idn?")
-        if "MODEL 24" not in model:
-            raise ValueError(f"Device Identifier not recognized: {model}")
-        print(f"connected to: {model}")
+        # software interlock on the current in mA, disabled when 0
+        self.current_limit = 0.0
+        self.tripped = False
+        # the longest that get_readbacks has taken, in seconds
+        self.readback_max = 0.0
+        # called with the current that tripped the interlock and the seconds
+        # from then until the output was confirmed off
+        self.on_trip: Optional[Callable[[float, float], None]] = None
 
-        # set up useful defaults
-        self.send_recv(self.startup_commands)
+        # readings are in ASCII until the format has been negotiated
+        self.data_format, self.little_endian = DataFormat.ASCII, False
+        self.line_frequency = LINE_FREQUENCY
+        self.connected = False
         self.last_recv = ""
 
+    def connect(self) -> bool:
+        """
+        Open the port, identify the instrument and set up useful defaults
+
+        The instrument is only reset if its output is off, so that connecting
+        to a supply that is already biasing a detector leaves it biased.
+        Returns True if the output was on.
+
+        Raises SerialException if the port cannot be opened, ResponseError if
+        the instrument does not answer and ValueError if it is not a 2400.
+        The port is left closed after a failure.
+        """
+        self.transport.open()
+        try:
+            # Check the connection
+            self.send_recv("")
+            model = self.send_recv("*idn?")
+            if not model:
+                raise ResponseError("no reply to *idn?", model)
+            if "MODEL 24" not in model:
+                raise ValueError(f"Device Identifier not recognized: {model}")
+
+            biased = self.get_source_status() == 1
+            if not biased:
+                self.send_recv("*RST")
+
+            # set up useful defaults
+            self.send_recv(self.startup_commands)
+            self.line_frequency = self.query_float(":SYSTEM:LFREQUENCY?")
+            if self.current_limit > 0:
+                self.send_recv(self.compliance_command())
+            self.data_format, self.little_endian = self.negotiate_format(
+                DataFormat.REAL32
+            )
+        except Exception:
+            self.transport.close()
+            raise
+        self.connected = True
+        print(f"connected to: {model}" + (" with output on" if biased else ""))
+        return biased
+
+    def disconnect(self):
+        self.connected = False
+        self.transport.close()
+
+    def resync(self) -> bool:
+        """
+        Bring the replies back in step with the queries after a timeout or a
+        garbled reply, returning True if the instrument then identifies itself
+
+        Late and partial replies are discarded and the error queue cleared.
+        """
+        cothread.Sleep(RESYNC_DRAIN)
+        self.transport.clear_input()
+        self.send_recv("*CLS")
+        return "MODEL 24" in self.send_recv("*idn?")
+
     def __del__(self):
-        if hasattr(self, "connection"):
-            self.ser.close()
+        if hasattr(self, "transport"):
+            self.transport.close()
 
-    def send_recv(self, send: str, respond: bool = False) -> str:
-        self.ser.write((send + "\n").encode())
+    def send_recv(
+        self,
+        send: str,
+        respond: bool = False,
+        priority=Priority.READBACK,
+        timeout: float = REPLY_TIMEOUT,
+    ) -> str:
+        respond = respond or send.endswith("?")
+        response = self.transport.send(send, respond, priority, timeout)
+        if respond:
+            self.last_recv = response
 
-        if respond or send.endswith("?"):
-            self.last_recv = self.ser.readline(100).decode()
-            response = self.last_recv
-            self.ser.flush()
+        return response
+
+    def query_values(
+        self, query: str, count: Optional[int] = None, timeout: float = REPLY_TIMEOUT
+    ) -> np.ndarray:
+        """
+        Send a query and decode its ',' or ';' separated numeric reply
+
+        Raises ResponseError if the reply is missing, is not numeric or does
+        not contain count values
+        """
+        reply = self.send_recv(query, respond=True, timeout=timeout)
+        return decode_ascii(reply, count)
+
+    def query_float(self, query: str) -> float:
+        return float(self.query_values(query, 1)[0])
+
+    def query_int(self, query: str) -> int:
+        return int(self.query_values(query, 1)[0])
+
+    def query_block(self, query: str, count: int) -> np.ndarray:
+        """
+        Query count readings in the negotiated data format
+        """
+        if self.data_format == DataFormat.ASCII:
+            # allow up to 15 characters per value e.g. "-5.000000E+02,"
+            size = count * 15
         else:
-            self.ser.flush()
-            response = ""
+            size = block_size(count)
+        # allow for the time it takes to send the reply over the wire
+        timeout = size * 10 / self.transport.ser.baudrate + REPLY_TIMEOUT
 
-        return response
+        if self.data_format == DataFormat.ASCII:
+            return self.query_values(query, count, timeout)
+        data = self.transport.query_binary(query, size, timeout=timeout)
+        return decode_block(data, count, self.little_endian)
+
+    def negotiate_format(self, preferred: DataFormat) -> Tuple[DataFormat, bool]:
+        """
+        Ask for the preferred data format for readings and return the format
+        and byte order that the instrument actually selected
+        """
+        self.send_recv(format_commands(preferred))
+        data_format = parse_format(self.send_recv(":FORMAT:DATA?"))
+        little_endian = False
+        if data_format == DataFormat.REAL32:
+            little_endian = self.send_recv(":FORMAT:BORDER?").upper() == "SWAP"
+        return data_format, little_endian
 
     def get_voltage(self) -> float:
-        volts = self.send_recv(":SOURCE:VOLTAGE?")
-        return float(volts)
+        return self.query_float(":SOURCE:VOLTAGE?")
 
     def set_voltage(self, volts: float):
+        if self.interlocked():
+            return
         # only allow negative voltages
         volts = math.fabs(volts) * -1
-        return self.send_recv(f":SOURCE:VOLTAGE {volts}")
+        return self.send_recv(f":SOURCE:VOLTAGE {volts}", priority=Priority.RAMP)
 
-    def get_current(self) -> float:
-        amps = self.send_recv(":SOURCE:CURRENT?")
+    def measure_current(self) -> float:
+        """
+        Take a reading and return its current in mA. The output must be on.
+        """
+        reading = self.query_block(MEASURE_QUERY, len(TRACE_ELEMENTS))
         # make it mAmps
-        return float(amps) * 1000
+        return float(reading[TRACE_ELEMENTS.index("CURRENT")]) * 1000
 
     def source_off(self, _):
-        self.send_recv(":SOURCE:CLEAR:IMMEDIATE")
+        self.send_recv(":SOURCE:CLEAR:IMMEDIATE", priority=Priority.ABORT)
 
     def source_on(self, _):
-        self.send_recv(":OUTPUT:STATE ON")
+        if self.interlocked():
+            return
+        self.send_recv(":OUTPUT:STATE ON", priority=Priority.RAMP)
 
-    def abort(self):
-        self.send_recv(":ABORT")
+    def abort(self) -> float:
+        """
+        Stop any ramp or trigger model as soon as possible, returning the
+        seconds taken to get :ABORT onto the wire
+
+        Ramp setpoints that are queued but not yet sent are dropped, and the
+        abort is written ahead of anything else queued even if the pipeline
+        of queries is full.
+        """
+        start = monotonic()
+        self.abort_flag = True
+        self.abort_event.Signal()
+        self.transport.cancel(Priority.RAMP)
+        self.send_recv(":ABORT", priority=Priority.ABORT)
         # come out of sweep mode if we are in it
         self.sweep_seconds = 0
+        return monotonic() - start
+
+    def clear_abort(self):
+        self.abort_flag = False
+        self.abort_event.Reset()
+
+    def wait_abort(self, seconds: float):
+        """
+        Sleep for seconds or until there is an abort
+        """
+        try:
+            self.abort_event.Wait(seconds)
+        except cothread.Timedout:
+            pass
+
+    def output_off(self) -> float:
+        """
+        Abort and turn the output off ahead of everything queued, returning
+        the seconds until the instrument confirmed that its output is off
+        """
+        start = monotonic()
         self.abort_flag = True
+        self.abort_event.Signal()
+        self.transport.cancel(Priority.RAMP)
+        self.sweep_seconds = 0
+        state = self.send_recv(OUTPUT_OFF_COMMAND, True, priority=Priority.ABORT)
+        if state.strip() != "0":
+            raise ResponseError("output not confirmed off", state)
+        return monotonic() - start
+
+    def check_limit(self, amps: float):
+        """
+        The software interlock, evaluated on every readback: turn the output
+        off if the magnitude of the current exceeds current_limit mA
+        """
+        if self.current_limit <= 0 or self.tripped or abs(amps) <= self.current_limit:
+            return
+        self.tripped = True
+        # report the trip even if the output could not be confirmed off
+        latency = math.inf
+        try:
+            latency = self.output_off()
+        finally:
+            if self.on_trip is not None:
+                self.on_trip(amps, latency)
+
+    def set_current_limit(self, limit: float):
+        """
+        Set the software interlock to limit mA, 0 to disable it, and the
+        hardware current compliance to match
+        """
+        self.current_limit = limit
+        if self.connected:
+            self.send_recv(self.compliance_command())
+
+    def compliance_command(self) -> str:
+        amps = DEFAULT_COMPLIANCE
+        if self.current_limit > 0:
+            amps = self.current_limit * COMPLIANCE_MARGIN / 1000
+        return f":SENSE:CURRENT:PROTECTION {amps:E}"
+
+    def interlocked(self) -> bool:
+        if self.tripped:
+            print("interlock tripped, command ignored until reset")
+        return self.tripped
+
+    def abort_bound(self, poll_period: float) -> float:
+        """
+        The seconds from an over current to the output being confirmed off,
+        outside of sweeps and trace holds, when readbacks are polled every
+        poll_period seconds: the poll period and the longest readback seen to
+        notice it, a command being written ahead of the off command, and the
+        largest round trip seen for that
+
+        The latencies are the largest observed, so this bounds what the link
+        has done so far rather than guaranteeing what it will do.
+        """
+        detect = poll_period + max(self.readback_max, MIN_LATENCY)
+        write = self.transport.write_time(OUTPUT_OFF_COMMAND)
+        return detect + write + self.latency(CommandClass.COMPOUND, WORST_PERCENTILE)
 
     def get_source_status(self) -> int:
-        result = self.send_recv(":OUTPUT:STATE?")
-        return int(result)
+        return self.query_int(":OUTPUT:STATE?")
+
+    def get_readbacks(self) -> Tuple[float, float, int]:
+        """
+        Read the voltage setpoint, measured current (in mA) and output state
+
+        The setpoint and state queries are chained into one compound SCPI
+        command so the instrument returns both on one line separated by ';'.
+        The current is then measured if the output is on.
+        """
+        with self.readback_lock:
+            start = monotonic()
+            volts, state = self.query_values(READBACKS_QUERY, 2)
+            amps = 0.0
+            if int(state) == 1:
+                amps = self.measure_current()
+                self.readback_max = max(self.readback_max, monotonic() - start)
+                self.check_limit(amps)
+        return float(volts), amps, int(state)
+
+    @property
+    def sweeping(self) -> bool:
+        """
+        True while the instrument is running its trigger model for a sweep
+        or a trace_hold, until its readings have been read back. The 2400
+        does not service queries until the trigger model completes.
+        """
+        return self.tracing
+
+    @property
+    def sweep_remaining(self) -> float:
+        elapsed = (datetime.now() - self.sweep_start).total_seconds()
+        return self.sweep_seconds - elapsed
 
     def source_voltage_ramp(self, to_volts: float, step_size: float, seconds: float):
-        cothread.Spawn(self.voltage_ramp_worker, *(to_volts, step_size, seconds))
+        cothread.Spawn(self.ramp, *(to_volts, step_size, seconds))
+
+    def ramp(self, to_volts: float, step_size: float, seconds: float) -> None:
+        """
+        Ramp the voltage using the currently selected ramp_engine
+        """
+        if self.interlocked():
+            return
+        if self.ramp_engine == RampEngine.SWEEP:
+            self.voltage_sweep_worker(to_volts, step_size, seconds)
+        else:
+            self.voltage_ramp_worker(to_volts, step_size, seconds)
+
+    def latency(
+        self, command_class: CommandClass, pct: float = PLANNING_PERCENTILE
+    ) -> float:
+        """
+        The latency in seconds for a class of command at the pct percentile,
+        by default the conservative one used for ramp planning
+        """
+        measured = self.transport.profiler.percentile(command_class, pct)
+        return MIN_LATENCY if measured is None else measured
+
+    def max_step_rate(self) -> float:
+        """
+        The fastest rate at which ramp setpoints can be sent, based on the
+        measured latencies and leaving room for one readback poll per step
+        """
+        step = self.latency(CommandClass.SET) + self.latency(CommandClass.COMPOUND)
+        return min(MAX_HZ, 1 / step)
+
+    def manual_steps(self, difference: float, step_size: float, seconds: float) -> int:
+        """
+        The setpoints in a manual ramp, limited to the rate the link can sustain
+        """
+        steps = abs(int(difference / step_size))
+        return max(min(steps, int(seconds * self.max_step_rate())), 1)
+
+    @property
+    def list_sweep(self) -> bool:
+        """
+        True if sweeps follow the ramp_profile through the source list
+        rather than the instrument's own linear sweep
+        """
+        return self.ramp_profile != RampProfile.LINEAR
+
+    def reading_time(self) -> float:
+        """
+        The seconds each reading takes besides the trigger delay: the source
+        delay then one integration for each measured function, auto zero
+        having been done once at connect rather than for every reading
+        """
+        integration = NPLC / self.line_frequency
+        return SOURCE_DELAY + len(MEASURED_FUNCTIONS) * integration
+
+    def max_points(self, seconds: float) -> int:
+        """
+        The most readings, including one at each end, that fit in seconds
+        """
+        return min(int(seconds / self.reading_time()) + 1, MAX_SWEEP_POINTS)
+
+    def sweep_points(self, difference: float, step_size: float, seconds: float) -> int:
+        """
+        The points in a sweep over seconds, including its start, within the
+        2400's limits and no closer together than a reading takes
+        """
+        points = abs(int(difference / step_size)) + 1
+        return max(min(points, self.max_points(seconds)), 2)
+
+    def ramp_steps(self, difference: float, step_size: float, seconds: float) -> int:
+        """
+        The steps in a ramp made with the selected ramp_engine
+        """
+        if self.ramp_engine == RampEngine.SWEEP:
+            return self.sweep_points(difference, step_size, seconds) - 1
+        return self.manual_steps(difference, step_size, seconds)
+
+    def hold_points(self, seconds: float, interval: float = TRACE_INTERVAL) -> int:
+        """
+        The readings taken by trace_hold in seconds, no closer together than
+        a reading takes
+        """
+        interval = max(interval, self.reading_time())
+        return min(max(int(seconds / interval), 1), MAX_SWEEP_POINTS)
+
+    def trace_overhead(self, points: int) -> float:
+        """
+        The expected seconds that run_trace takes beyond the trace itself, to
+        set up the trigger model, wait for it and read back points readings
+        """
+        set_latency = self.latency(CommandClass.SET, EXPECTED_PERCENTILE)
+        query_latency = self.latency(CommandClass.QUERY, EXPECTED_PERCENTILE)
+        size = block_size(points * len(TRACE_ELEMENTS))
+        transfer = size * 10 / self.transport.ser.baudrate
+        # the end of the trace is noticed half a poll late on average
+        return 2 * set_latency + 4 * query_latency + SWEEP_POLL / 2 + transfer
+
+    def ramp_overhead(self, steps: int) -> float:
+        """
+        The expected seconds that a ramp of steps takes beyond its ramp time
+        with the selected ramp_engine
+        """
+        set_latency = self.latency(CommandClass.SET, EXPECTED_PERCENTILE)
+        query_latency = self.latency(CommandClass.QUERY, EXPECTED_PERCENTILE)
+        if self.ramp_engine == RampEngine.SWEEP:
+            if self.list_sweep:
+                return query_latency + self.list_overhead(steps + 1)
+            overhead = self.trace_overhead(steps + 1)
+            return query_latency + 2 * set_latency + overhead
+        # the initial voltage query, mode commands and the final step
+        return query_latency + 3 * set_latency
+
+    def list_overhead(self, points: int) -> float:
+        """
+        The expected seconds that run_list takes beyond the list itself, to
+        upload points setpoints, run them and read back their readings
+        """
+        set_latency = self.latency(CommandClass.SET, EXPECTED_PERCENTILE)
+        chunks = math.ceil(points / LIST_CHUNK_POINTS)
+        chars = points * LIST_VALUE_CHARS + chunks * len(LIST_APPEND_COMMAND)
+        upload = chars * 10 / self.transport.ser.baudrate
+        return 2 * set_latency + upload + self.trace_overhead(points)
+
+    def profile(self, samples: int = 100) -> str:
+        """
+        Time samples of each class of command and return a summary table
+
+        Previous measurements are discarded so that the results reflect the
+        link as it is now. Readbacks from the update loop continue to add
+        samples while the IOC is running.
+        """
+        profiler = self.transport.profiler
+        profiler.clear()
+        for _ in range(samples):
+            self.send_recv(PROFILE_SET_COMMAND)
+            self.send_recv(":SOURCE:VOLTAGE?")
+            self.send_recv(READBACKS_QUERY)
+        return profiler.dump()
 
     def voltage_ramp_worker(
         self, to_volts: float, step_size: float, seconds: float
@@ -98,12 +575,18 @@ class Keithley(object):
 
         This has the benefit of being able to get readbacks during
         the ramp. But the downside is that it cannot be particularly
-        fine grained. 20Hz updates is about the limit.
+        fine grained, the step rate is limited by max_step_rate. The
+        setpoints follow the ramp_profile.
 
-        The alternative is voltage_sweep but that has all sorts of
-        issues that are yet to be fixed
+        Each step is sent at an absolute deadline measured from the start
+        of the ramp so that serial latency does not accumulate. Steps whose
+        deadline has already passed are skipped and the final step is
+        always exactly to_volts at the requested time.
+
+        The alternative is voltage_sweep_worker which is hardware timed
+        but provides no readbacks until the sweep has completed
         """
-        self.abort_flag = False
+        self.clear_abort()
         voltage = self.get_voltage()
         # only allow negative values
         to_volts = -math.fabs(to_volts)
@@ -111,26 +594,256 @@ class Keithley(object):
         if difference == 0 or seconds <= 0:
             return
 
-        # calculate steps and step_size but limit to 20Hz
-        steps = abs(int(difference / step_size))
-        if steps / seconds > MAX_HZ:
-            steps = int(seconds * MAX_HZ)
-        step_size = difference / steps
-        interval = seconds / steps - LOOP_OVERHEAD
-
-        self.send_recv(":SOURCE:FUNCTION:MODE VOLTAGE")
-        self.send_recv(":SOURCE:VOLTAGE:MODE FIXED")
-        for step in range(steps + 1):
+        # calculate steps but limit to the rate the link can sustain
+        steps = self.manual_steps(difference, step_size, seconds)
+        interval = seconds / steps
+        volts = setpoints(self.ramp_profile, voltage, to_volts, steps)
+
+        self.send_recv(":SOURCE:FUNCTION:MODE VOLTAGE", priority=Priority.RAMP)
+        self.send_recv(":SOURCE:VOLTAGE:MODE FIXED", priority=Priority.RAMP)
+
+        start = monotonic()
+        self.step_times = []
+        step = 0
+        while step < steps and not self.abort_flag:
+            # skip to the latest step that is due, but always take one
+            elapsed = monotonic() - start
+            step = min(max(step + 1, int(elapsed / interval)), steps)
+
+            self.wait_abort(max(start + step * interval - monotonic(), 0))
             if self.abort_flag:
                 break
-            self.send_recv(f":SOURCE:VOLTAGE {voltage}")
-            self.get_voltage()
-            voltage += step_size
-            cothread.Sleep(interval)
 
-    startup_commands = """
+            command = f":SOURCE:VOLTAGE {volts[step - 1]}"
+            if not self.transport.write(command, priority=Priority.RAMP):
+                # dropped by an abort before it was written
+                break
+            self.step_times.append((step * interval, monotonic() - start))
+            self.steps_sent += 1
+
+    def voltage_sweep_worker(
+        self, to_volts: float, step_size: float, seconds: float
+    ) -> None:
+        """
+        A voltage ramp using the instrument's internal sweep engine
+
+        The sweep is uploaded and triggered in one go so that the step
+        timing is controlled by the instrument rather than the host. Each
+        point is measured into the trace buffer which is read back into
+        trace_readings once the sweep has completed.
+
+        A LINEAR ramp_profile uses the instrument's linear sweep. Any other
+        profile is uploaded as a source list.
+        """
+        self.clear_abort()
+        self.trace_readings = np.zeros((0, 3))
+        voltage = self.get_voltage()
+        # only allow negative values
+        to_volts = -math.fabs(to_volts)
+        difference = to_volts - voltage
+        # a STOP while the voltage was being read
+        if difference == 0 or seconds <= 0 or self.abort_flag:
+            return
+
+        points = self.sweep_points(difference, step_size, seconds)
+        delay = seconds / (points - 1)
+
+        if self.list_sweep:
+            volts = setpoints(self.ramp_profile, voltage, to_volts, points - 1)
+            self.run_list(np.insert(volts, 0, voltage), delay)
+            return
+
+        # the fixed level is what the output returns to after the sweep
+        # so it is set to the target once sweep mode has been selected
+        self.send_recv(
+            f"""
+:SOURCE:FUNCTION:MODE VOLTAGE
+:SOURCE:VOLTAGE:MODE SWEEP
+:SOURCE:SWEEP:SPACING LINEAR
+:SOURCE:VOLTAGE:START {voltage}
+:SOURCE:VOLTAGE:STOP {to_volts}
+:SOURCE:SWEEP:POINTS {points}
+:SOURCE:VOLTAGE {to_volts}
+""",
+            priority=Priority.RAMP,
+        )
+        self.run_trace(points, delay, seconds)
+        self.end_sweep(voltage)
+
+    def run_sequence(self, volts: np.ndarray, delay: float) -> None:
+        """
+        Run a whole cycle compiled into setpoints delay seconds apart, see
+        planner.compile_cycle, with nothing sent by the host until it has
+        finished or been aborted
+        """
+        if self.interlocked():
+            return
+        self.clear_abort()
+        self.trace_readings = np.zeros((0, 3))
+        # only allow negative values
+        self.run_list(-np.abs(volts), delay)
+
+    def run_list(self, volts: np.ndarray, delay: float) -> None:
+        """
+        Step the output through volts from the source list, delay seconds
+        apart, measuring each point into the trace buffer
+        """
+        if self.abort_flag:
+            return
+        # the list is sent LIST_CHUNK_POINTS values at a time
+        lists = "\n".join(
+            (LIST_APPEND_COMMAND if start else LIST_COMMAND)
+            + " "
+            + ",".join(f"{v:.3f}" for v in volts[start : start + LIST_CHUNK_POINTS])
+            for start in range(0, len(volts), LIST_CHUNK_POINTS)
+        )
+        # the fixed level is what the output returns to after the list
+        self.send_recv(
+            f"""
+:SOURCE:FUNCTION:MODE VOLTAGE
+:SOURCE:VOLTAGE:MODE LIST
+{lists}
+:SOURCE:VOLTAGE {volts[-1]}
+""",
+            priority=Priority.RAMP,
+        )
+        self.run_trace(len(volts), delay, delay * (len(volts) - 1))
+        self.end_sweep(volts[0])
+
+    def end_sweep(self, start: float):
+        """
+        Return to a fixed voltage after a sweep or list that began at start
+
+        The fixed level was set to the end of the sweep, so after an abort it
+        is first set to where the sweep stopped, so that the output is not
+        stepped to the end.
+        """
+        # the points reached before any abort
+        self.steps_sent += len(self.trace_readings)
+        if self.abort_flag:
+            if len(self.trace_readings):
+                start = self.trace_readings[-1, 0]
+            self.send_recv(f":SOURCE:VOLTAGE {start}", priority=Priority.RAMP)
+        self.send_recv(":SOURCE:VOLTAGE:MODE FIXED", priority=Priority.RAMP)
+
+    def trace_hold(self, seconds: float, interval: float = TRACE_INTERVAL) -> None:
+        """
+        Hold the output at its present level for seconds while the instrument
+        measures into the trace buffer every interval seconds
+
+        The readings are read back into trace_readings in one binary
+        transfer at the end of the hold rather than polling throughout.
+        """
+        self.clear_abort()
+        self.trace_readings = np.zeros((0, 3))
+        if seconds <= 0:
+            return
+
+        points = self.hold_points(seconds, interval)
+        self.send_recv(":SOURCE:VOLTAGE:MODE FIXED", priority=Priority.RAMP)
+        self.run_trace(points, seconds / points, seconds)
+
+    def run_trace(self, points: int, interval: float, seconds: float) -> None:
+        """
+        Run the trigger model for points readings interval seconds apart into
+        the trace buffer and wait for it to complete, or for an abort
+
+        The trigger model is not started at all after an abort, as the
+        :ABORT sent for it would have reached the instrument first.
+        """
+        if self.abort_flag:
+            return
+        # the pollers stop starting readbacks, and one under way finishes
+        # first, as its :READ? would otherwise run the trigger model once it
+        # had been set up for the trace
+        self.tracing = True
+        try:
+            with self.readback_lock:
+                try:
+                    self.trigger_trace(points, interval, seconds)
+                finally:
+                    self.send_recv(TRIGGER_RESET)
+        finally:
+            self.tracing = False
+
+    def trigger_trace(self, points: int, interval: float, seconds: float) -> None:
+        # the trigger delay is the part of the interval not spent on a reading
+        delay = max(interval - self.reading_time(), 0.0)
+        if self.current_limit > 0:
+            # the software interlock only sees the readings once the trigger
+            # model has finished, so the hardware must limit the current
+            self.send_recv(self.compliance_command(), priority=Priority.RAMP)
+        self.send_recv(
+            f"""
+:TRACE:CLEAR
+:TRACE:POINTS {points}
+:TRACE:FEED SENSE
+:TRACE:FEED:CONTROL NEXT
+:TRIGGER:CLEAR
+:TRIGGER:SEQ1:COUNT {points}
+:TRIGGER:SEQ1:DELAY {delay}
+:TRIGGER:SEQ1:SOURCE IMMEDIATE
+""",
+            priority=Priority.RAMP,
+        )
+        self.sweep_start = datetime.now()
+        self.sweep_seconds = seconds
+        self.trace_start = monotonic()
+        # other queries sent before tracing was set must be answered before
+        # :INIT, as the instrument does not reply to them during the trace
+        self.wait_complete()
+        if self.abort_flag:
+            self.sweep_seconds = 0
+            return
+        self.send_recv(":INIT", priority=Priority.RAMP)
+
+        while self.sweep_remaining > 0 and not self.abort_flag:
+            self.wait_abort(SWEEP_POLL)
+        self.sweep_seconds = 0
+
+        # the reply to *OPC? is held back until the trigger model has
+        # finished or been aborted, then the buffer holds what was measured
+        self.wait_complete(seconds + REPLY_TIMEOUT)
+        self.trace_readings = self.read_trace()
+
+    def wait_complete(self, timeout: float = REPLY_TIMEOUT):
+        """
+        Wait until the instrument has finished everything sent to it
+
+        If *OPC? is not answered within timeout seconds the instrument is
+        still busy, and anything else sent would be answered out of step, so
+        it is aborted and ResponseError raised.
+        """
+        reply = self.send_recv("*OPC?", timeout=timeout)
+        if reply.strip() != "1":
+            self.abort()
+            raise ResponseError("*OPC? not answered", reply)
+
+    def read_trace(self) -> np.ndarray:
+        """
+        Read the trace buffer as rows of (volts, mA, seconds) in a single
+        transfer, binary unless the instrument only accepted ASCII
+        """
+        points = self.query_int(":TRACE:POINTS:ACTUAL?")
+        if points == 0:
+            return np.zeros((0, 3))
+
+        values = self.query_block(":TRACE:DATA?", points * len(TRACE_ELEMENTS))
+        readings = values.reshape(points, len(TRACE_ELEMENTS)).astype(float)
+        # make it mAmps
+        readings[:, 1] *= 1000
+        self.check_limit(np.abs(readings[:, 1]).max())
+        return readings
+
+    startup_commands = f"""
 :syst:beep:stat 0
-:SENSE:FUNCTION:ON  "CURRENT:DC","VOLTAGE:DC"
+{TRIGGER_RESET}
+:FORMAT:ELEMENTS {",".join(TRACE_ELEMENTS)}
+:SENSE:FUNCTION:ON {",".join(f'"{name}"' for name in MEASURED_FUNCTIONS)}
+:SENSE:CURRENT:NPLCYCLES {NPLC}
+:SYSTEM:AZERO:STATE ONCE
+:SOURCE:DELAY:AUTO OFF
+:SOURCE:DELAY {SOURCE_DELAY}
 :SENSE:CURRENT:RANGE:AUTO 1
 :SENSE:VOLTAGE:RANGE:AUTO 1
 :SOURCE:VOLTAGE:RANGE:AUTO 1
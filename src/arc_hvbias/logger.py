@@ -0,0 +1,150 @@
+"""
+Persistent logging of readbacks and status to append only binary segments
+
+Rows are collected into fixed size numpy chunks by the update loop and
+written out by a background thread, so that a slow disk never holds up
+polling. Each segment file is a plain array of LOG_DTYPE rows with no header,
+named by prefix and the time it was started, so that any segment can be
+memory mapped with read_segment, e.g. for a day of data
+
+    for path in segment_paths("/var/log/hvbias", "BL15J-EA-HV-01", "20260101"):
+        rows = read_segment(path)
+        print(rows["time"][0], rows["volts"].min())
+"""
+
+import queue
+import threading
+from datetime import datetime
+from pathlib import Path
+from time import time
+from typing import List, Optional
+
+import numpy as np
+
+# time is seconds since the epoch, amps is in mA, state is the output state
+# and status the Status of the cycle at the time
+LOG_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),
+        ("volts", "<f4"),
+        ("amps", "<f4"),
+        ("state", "u1"),
+        ("status", "u1"),
+    ]
+)
+# rows collected before a chunk is handed to the writer thread
+CHUNK_ROWS = 1024
+# longest time a row waits in a partly filled chunk
+FLUSH_PERIOD = 5.0
+# chunks waiting for the writer thread before new ones are dropped
+MAX_PENDING = 64
+# a new segment is started when the current one reaches either limit
+ROTATE_BYTES = 64 * 1024 * 1024
+ROTATE_SECONDS = 3600.0
+SEGMENT_SUFFIX = ".bin"
+
+
+def segment_paths(directory: str, prefix: str, day: str = "") -> List[Path]:
+    """
+    The segment files for prefix in directory, oldest first, optionally only
+    those started on day given as YYYYMMDD
+    """
+    return sorted(Path(directory).glob(f"{prefix}-{day}*{SEGMENT_SUFFIX}"))
+
+
+def read_segment(path: Path) -> np.ndarray:
+    """
+    Memory map the rows of a segment, which may still be being written
+    """
+    rows = path.stat().st_size // LOG_DTYPE.itemsize
+    if rows == 0:
+        return np.zeros(0, dtype=LOG_DTYPE)
+    return np.memmap(path, dtype=LOG_DTYPE, mode="r", shape=(rows,))
+
+
+class Logger(object):
+    """
+    Logs rows for one instrument to segments in directory
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str,
+        rotate_bytes: int = ROTATE_BYTES,
+        rotate_seconds: float = ROTATE_SECONDS,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+
+        self.chunk = np.zeros(CHUNK_ROWS, dtype=LOG_DTYPE)
+        self.rows = 0
+        self.last_flush = time()
+        self.pending: queue.Queue = queue.Queue(MAX_PENDING)
+
+        # counters for the IOC, rows_written is updated by the writer thread
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.write_errors = 0
+
+        self.segment: Optional[Path] = None
+        self.segment_start = 0.0
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def log(self, volts: float, amps: float, state: int, status: int):
+        """
+        Add a row, never waiting for the disk
+        """
+        now = time()
+        self.chunk[self.rows] = (now, volts, amps, state, status)
+        self.rows += 1
+        if self.rows == CHUNK_ROWS or now - self.last_flush > FLUSH_PERIOD:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time()
+        if self.rows == 0:
+            return
+        try:
+            self.pending.put_nowait(self.chunk[: self.rows].copy())
+        except queue.Full:
+            self.rows_dropped += self.rows
+        self.rows = 0
+
+    def close(self):
+        """
+        Write out the rows logged so far and stop the writer thread
+        """
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+
+    def next_segment(self, now: float) -> Path:
+        # to the microsecond so that rotating quickly never reopens a segment
+        stamp = datetime.fromtimestamp(now).strftime("%Y%m%d-%H%M%S-%f")
+        return self.directory / f"{self.prefix}-{stamp}{SEGMENT_SUFFIX}"
+
+    def writer(self):
+        while True:
+            rows = self.pending.get()
+            if rows is None:
+                return
+            try:
+                now = rows["time"][0]
+                if (
+                    self.segment is None
+                    or self.segment.stat().st_size >= self.rotate_bytes
+                    or now - self.segment_start >= self.rotate_seconds
+                ):
+                    self.segment = self.next_segment(now)
+                    self.segment_start = now
+                with open(self.segment, "ab") as f:
+                    f.write(rows.tobytes())
+                self.rows_written += len(rows)
+            except OSError as e:
+                self.write_errors += 1
+                print("log write failed", e)
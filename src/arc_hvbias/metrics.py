@@ -0,0 +1,141 @@
+"""
+Measurements of how each depolarisation cycle went, and a bounded history
+of them for tuning the cycle settings against detector dead time
+"""
+
+import csv
+from collections import deque
+from datetime import datetime
+from enum import IntEnum
+from time import monotonic, time
+from typing import Deque, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .status import Status
+
+# the cycles kept in the history
+HISTORY_LENGTH = 100
+# the statuses of a cycle whose durations are measured. The initial ramp to
+# the on voltage is not in a phase of its own, so is not included.
+PHASES = (
+    Status.RAMP_UP,
+    Status.VOLTAGE_OFF,
+    Status.RAMP_DOWN,
+    Status.VOLTAGE_ON,
+    Status.LIST_CYCLE,
+)
+
+
+class Outcome(IntEnum):
+    COMPLETED = 0
+    STOPPED = 1
+    INTERLOCK = 2
+    FAILED = 3
+
+
+class CycleMetrics(NamedTuple):
+    """
+    How one cycle went
+    """
+
+    # seconds since the epoch
+    start: float
+    end: float
+    # seconds spent in each of PHASES
+    phases: Tuple[float, ...]
+    # the largest magnitude of the current in mA and its integral in mC
+    peak_current: float
+    charge: float
+    # setpoints sent by the host or stepped through by the instrument
+    steps: int
+    outcome: Outcome
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class CycleRecorder(object):
+    """
+    Times the phases of a cycle as it runs
+    """
+
+    def __init__(self, steps: int):
+        self.start = time()
+        self.steps = steps
+        self.phases = np.zeros(len(PHASES))
+        self.phase: Optional[Status] = None
+        self.phase_start = monotonic()
+
+    def enter(self, status: Status):
+        now = monotonic()
+        if self.phase in PHASES:
+            self.phases[PHASES.index(self.phase)] += now - self.phase_start
+        self.phase, self.phase_start = status, now
+
+    def finish(self, samples: np.ndarray, steps: int, outcome: Outcome) -> CycleMetrics:
+        """
+        The metrics of the cycle given its (time, volts, mA) samples and the
+        count of steps sent so far
+        """
+        self.enter(Status.HOLD)
+        peak_current = charge = 0.0
+        if len(samples):
+            times, amps = samples[:, 0], np.abs(samples[:, 2])
+            peak_current = float(amps.max())
+            # trapezoidal integration
+            charge = float(np.sum((amps[1:] + amps[:-1]) * np.diff(times)) / 2)
+        return CycleMetrics(
+            start=self.start,
+            end=time(),
+            phases=tuple(float(seconds) for seconds in self.phases),
+            peak_current=peak_current,
+            charge=charge,
+            steps=steps - self.steps,
+            outcome=outcome,
+        )
+
+
+class CycleHistory(object):
+    """
+    The metrics of the most recent cycles, oldest first
+    """
+
+    def __init__(self, length: int = HISTORY_LENGTH):
+        self.cycles: Deque[CycleMetrics] = deque(maxlen=length)
+
+    def __len__(self) -> int:
+        return len(self.cycles)
+
+    def add(self, metrics: CycleMetrics):
+        self.cycles.append(metrics)
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        One of the fields of CycleMetrics, or duration, for every cycle
+        """
+        return np.array([getattr(cycle, name) for cycle in self.cycles], dtype=float)
+
+    def export(self, path: str):
+        """
+        Write the history to path as CSV, one row per cycle
+        """
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["start", "end", "duration"]
+                + [f"{status.name.lower()}_time" for status in PHASES]
+                + ["peak_current", "charge", "steps", "outcome"]
+            )
+            for cycle in self.cycles:
+                writer.writerow(
+                    [
+                        datetime.fromtimestamp(cycle.start).isoformat(),
+                        datetime.fromtimestamp(cycle.end).isoformat(),
+                        f"{cycle.duration:.3f}",
+                    ]
+                    + [f"{seconds:.3f}" for seconds in cycle.phases]
+                    + [cycle.peak_current, cycle.charge, cycle.steps]
+                    + [cycle.outcome.name]
+                )
@@ -0,0 +1,240 @@
+"""
+Prediction of how long a depolarisation cycle will take with the present
+settings and the measured serial link latency, before it is started, and
+compilation of a whole cycle into a source list for the 2400 to run by itself
+"""
+
+import math
+from enum import IntEnum
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .keithley import (
+    EXPECTED_PERCENTILE,
+    LIST_CHUNK_POINTS,
+    MAX_SWEEP_POINTS,
+    Keithley,
+)
+from .profiler import CommandClass
+from .profiles import RampProfile, profile_volts
+
+# a list cycle is refused if its steps are more than this factor coarser than
+# the requested step size even with as many points as the 2400 holds
+MAX_LIST_COARSENING = 2.0
+
+
+class Verdict(IntEnum):
+    OK = 0
+    WARNING = 1
+    REFUSED = 2
+
+
+class CycleSettings(NamedTuple):
+    """
+    The settings of one depolarisation cycle, as in the HvBias records
+    """
+
+    on_volts: float
+    off_volts: float
+    rise_time: float
+    hold_time: float
+    fall_time: float
+    repeats: int
+    step_size: float
+    trace_hold: bool = False
+    ramp_profile: RampProfile = RampProfile.LINEAR
+    # run the whole cycle from the source list, see compile_cycle
+    list_cycle: bool = False
+
+
+class CyclePlan(NamedTuple):
+    """
+    The expected duration of a cycle and the ramps it will actually make
+    """
+
+    duration: float
+    # steps per second of the slower of the two ramps
+    step_rate: float
+    # volts per step of the coarser of the two ramps
+    step_size: float
+    verdict: Verdict
+    # why the plan is not OK, short enough for a stringIn record
+    message: str = ""
+
+
+class CycleSequence(NamedTuple):
+    """
+    A whole cycle as source list setpoints, delay seconds apart
+    """
+
+    volts: np.ndarray
+    delay: float
+
+    @property
+    def duration(self) -> float:
+        return self.delay * (len(self.volts) - 1)
+
+
+def plan_ramp(
+    k: Keithley, difference: float, step_size: float, seconds: float
+) -> Tuple[float, int]:
+    """
+    The expected duration and number of steps of a ramp over difference volts
+    """
+    if difference == 0 or seconds <= 0:
+        # only the query of the present voltage
+        return k.latency(CommandClass.QUERY, EXPECTED_PERCENTILE), 0
+    steps = k.ramp_steps(difference, step_size, seconds)
+    return seconds + k.ramp_overhead(steps), steps
+
+
+def plan_cycle(k: Keithley, settings: CycleSettings, volts: float) -> CyclePlan:
+    """
+    Plan a cycle starting from volts, following cycle_control: an initial
+    ramp to the on voltage, then for each repeat a ramp to the off voltage,
+    a hold and a ramp back, with a further hold between repeats
+    """
+    on_volts = -math.fabs(settings.on_volts)
+    off_volts = -math.fabs(settings.off_volts)
+    span = off_volts - on_volts
+
+    if settings.step_size <= 0:
+        return CyclePlan(0.0, 0.0, 0.0, Verdict.REFUSED, "STEP-SIZE must be positive")
+    if settings.repeats < 1:
+        return CyclePlan(0.0, 0.0, 0.0, Verdict.REFUSED, "REPEATS must be at least 1")
+    if span and (settings.rise_time <= 0 or settings.fall_time <= 0):
+        return CyclePlan(
+            0.0, 0.0, 0.0, Verdict.REFUSED, "RISE-TIME and FALL-TIME must be > 0"
+        )
+    if settings.list_cycle:
+        return plan_list_cycle(k, settings, volts)
+
+    initial, _ = plan_ramp(k, on_volts - volts, settings.step_size, settings.fall_time)
+    rise, rise_steps = plan_ramp(k, span, settings.step_size, settings.rise_time)
+    fall, fall_steps = plan_ramp(k, -span, settings.step_size, settings.fall_time)
+    hold = settings.hold_time
+    if settings.trace_hold and hold > 0:
+        # the mode command then the trace
+        hold += k.latency(CommandClass.SET, EXPECTED_PERCENTILE) + k.trace_overhead(
+            k.hold_points(hold)
+        )
+    holds = 2 * settings.repeats - 1
+    duration = initial + settings.repeats * (rise + fall) + holds * hold
+
+    if not span:
+        return CyclePlan(duration, 0.0, 0.0, Verdict.OK)
+
+    step_rate = min(rise_steps / settings.rise_time, fall_steps / settings.fall_time)
+    step_size = abs(span) / min(rise_steps, fall_steps)
+    return check_steps(duration, step_rate, step_size, settings.step_size)
+
+
+def plan_list_cycle(k: Keithley, settings: CycleSettings, volts: float) -> CyclePlan:
+    """
+    Plan a cycle compiled into a source list, which steps at a fixed rate
+    """
+    sequence = compile_cycle(settings, volts, min_interval=k.reading_time())
+    duration = sequence.duration + k.list_overhead(len(sequence.volts))
+    step_size = max_step(sequence)
+    step_rate = 1 / sequence.delay if sequence.delay else 0.0
+    if step_size > settings.step_size * MAX_LIST_COARSENING:
+        message = f"list steps {step_size:.3g} V, use HOST"
+        return CyclePlan(duration, step_rate, step_size, Verdict.REFUSED, message)
+    return check_steps(duration, step_rate, step_size, settings.step_size)
+
+
+def check_steps(
+    duration: float, step_rate: float, step_size: float, requested: float
+) -> CyclePlan:
+    """
+    A plan that warns if its steps are coarser than the requested step size
+    """
+    if step_size > requested * (1 + 1e-9):
+        message = f"steps coarsened to {step_size:.3g} V"
+        return CyclePlan(duration, step_rate, step_size, Verdict.WARNING, message)
+    return CyclePlan(duration, step_rate, step_size, Verdict.OK)
+
+
+def cycle_segments(
+    settings: CycleSettings, volts: float
+) -> List[Tuple[float, float, float]]:
+    """
+    The (seconds, start volts, stop volts) of each ramp and hold of a cycle
+    starting from volts, in the order that cycle_control makes them
+    """
+    on_volts = -math.fabs(settings.on_volts)
+    off_volts = -math.fabs(settings.off_volts)
+    segments = []
+    if volts != on_volts:
+        segments.append((settings.fall_time, volts, on_volts))
+    for repeat in range(settings.repeats):
+        if repeat > 0:
+            segments.append((settings.hold_time, on_volts, on_volts))
+        segments += [
+            (settings.rise_time, on_volts, off_volts),
+            (settings.hold_time, off_volts, off_volts),
+            (settings.fall_time, off_volts, on_volts),
+        ]
+    return segments
+
+
+def max_step(sequence: CycleSequence) -> float:
+    return float(np.abs(np.diff(sequence.volts)).max())
+
+
+def list_points(
+    settings: CycleSettings, volts: float, min_interval: float = 0.0
+) -> int:
+    """
+    The points for compile_cycle: at least one source list command's worth,
+    and more if needed to step no more than the step size, up to as many as
+    the 2400 holds and no closer together than min_interval seconds
+    """
+    most = MAX_SWEEP_POINTS
+    if min_interval > 0:
+        seconds = sum(seconds for seconds, _, _ in cycle_segments(settings, volts))
+        most = max(min(int(seconds / min_interval) + 1, most), 2)
+    points = min(LIST_CHUNK_POINTS, most)
+    while points < most:
+        step = max_step(compile_cycle(settings, volts, points))
+        if step <= settings.step_size * (1 + 1e-9):
+            break
+        # the largest step shrinks in proportion to the spacing of the points
+        needed = math.ceil(points * step / max(settings.step_size, 1e-9))
+        points = min(max(needed, points + 1), most)
+    return points
+
+
+def compile_cycle(
+    settings: CycleSettings,
+    volts: float,
+    points: Optional[int] = None,
+    min_interval: float = 0.0,
+) -> CycleSequence:
+    """
+    Sample a whole cycle starting from volts at points equally spaced times,
+    by default as many as list_points chooses for readings min_interval
+    seconds long
+
+    The 2400 has a single trigger delay for the whole list, so the corners
+    between ramps and holds fall on the nearest sample, within one delay of
+    where cycle_control would make them.
+    """
+    if points is None:
+        points = list_points(settings, volts, min_interval)
+    segments = cycle_segments(settings, volts)
+    durations = np.array([seconds for seconds, _, _ in segments])
+    ends = np.cumsum(durations)
+    t = np.linspace(0, ends[-1], points)
+    # the segment each sample falls in, which is never one of no duration
+    index = np.minimum(np.searchsorted(ends, t, side="right"), len(segments) - 1)
+    elapsed = t - (ends - durations)[index]
+    fraction = np.divide(
+        elapsed, durations[index], out=np.ones_like(t), where=durations[index] > 0
+    )
+    sampled = np.empty(points)
+    for i, (_, start, stop) in enumerate(segments):
+        at = index == i
+        sampled[at] = profile_volts(settings.ramp_profile, start, stop, fraction[at])
+    return CycleSequence(sampled, ends[-1] / (points - 1))
@@ -0,0 +1,84 @@
+"""
+Records how long each class of SCPI command takes on the serial link so that
+ramp planning can use measured latencies rather than guesses
+"""
+
+import math
+from collections import deque
+from enum import IntEnum
+from typing import Deque, Dict, Optional
+
+# the number of most recent samples kept for each command class
+PROFILE_SAMPLES = 1000
+# percentiles reported for each command class
+PERCENTILES = (50, 95, 99)
+
+
+class CommandClass(IntEnum):
+    """
+    Groups of commands with similar costs on the link
+    """
+
+    SET = 0
+    QUERY = 1
+    COMPOUND = 2
+
+
+def classify(command: str, respond: bool) -> CommandClass:
+    if not respond:
+        return CommandClass.SET
+    if ";" in command:
+        return CommandClass.COMPOUND
+    return CommandClass.QUERY
+
+
+class LatencyProfiler(object):
+    """
+    Bounded latency histories for each CommandClass with percentile summaries
+    """
+
+    def __init__(self, samples: int = PROFILE_SAMPLES):
+        self.samples: Dict[CommandClass, Deque[float]] = {
+            command_class: deque(maxlen=samples) for command_class in CommandClass
+        }
+
+    def record(self, command_class: CommandClass, seconds: float):
+        self.samples[command_class].append(seconds)
+
+    def clear(self):
+        for samples in self.samples.values():
+            samples.clear()
+
+    def percentile(self, command_class: CommandClass, pct: float) -> Optional[float]:
+        """
+        Nearest rank percentile in seconds, or None if there are no samples
+        """
+        samples = sorted(self.samples[command_class])
+        if not samples:
+            return None
+        rank = max(math.ceil(pct / 100 * len(samples)), 1)
+        return samples[rank - 1]
+
+    def summary(self) -> Dict[CommandClass, Dict[int, Optional[float]]]:
+        return {
+            command_class: {
+                pct: self.percentile(command_class, pct) for pct in PERCENTILES
+            }
+            for command_class in CommandClass
+        }
+
+    def dump(self) -> str:
+        """
+        A table of sample counts and percentiles in milliseconds
+        """
+        header = "class".ljust(10) + "count".rjust(8)
+        header += "".join(f"p{pct}(ms)".rjust(10) for pct in PERCENTILES)
+        lines = [header]
+        for command_class, percentiles in self.summary().items():
+            line = command_class.name.ljust(10)
+            line += str(len(self.samples[command_class])).rjust(8)
+            for value in percentiles.values():
+                text = "-" if value is None else f"{value * 1000:.2f}"
+                line += text.rjust(10)
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,85 @@
+"""
+Shapes of voltage ramps, each computed up front as a whole array of setpoints
+
+Setpoints are spaced equally in time. The manual ramp sends one of them per
+step, and an instrument list sweep steps through them with one trigger delay.
+A faster start or a slower approach to full bias can then shorten a cycle,
+or reduce the change in charging current, without changing how the ramp
+is timed.
+"""
+
+from enum import IntEnum
+from typing import Callable, Dict
+
+import numpy as np
+
+
+class RampProfile(IntEnum):
+    LINEAR = 0
+    # fast at first, approaching the target exponentially
+    EXPONENTIAL = 1
+    # slow at both ends, limiting the rate of change of the charging current
+    S_CURVE = 2
+    # fast near zero and slower near full bias, see SEGMENT_KNEE
+    SEGMENTED = 3
+
+
+# time constants in the length of an EXPONENTIAL ramp
+EXPONENTIAL_RATE = 4.0
+# a SEGMENTED ramp moves SEGMENT_SPEEDUP times as fast below SEGMENT_KNEE of
+# the larger magnitude of its two end voltages as it does above it
+SEGMENT_KNEE = 0.5
+SEGMENT_SPEEDUP = 4.0
+
+# the fraction of the voltage change made against the fraction of the time
+# elapsed, for the profiles that do not depend on the voltages themselves
+SHAPES: Dict[RampProfile, Callable[[np.ndarray], np.ndarray]] = {
+    RampProfile.LINEAR: lambda t: t,
+    RampProfile.EXPONENTIAL: lambda t: (
+        np.expm1(-EXPONENTIAL_RATE * t) / np.expm1(-EXPONENTIAL_RATE)
+    ),
+    RampProfile.S_CURVE: lambda t: t * t * (3 - 2 * t),
+}
+
+
+def segmented(start: float, stop: float, t: np.ndarray) -> np.ndarray:
+    """
+    The voltages of a SEGMENTED ramp at the fractions t of its time, found by
+    interpolating between the voltages at which its speed changes
+    """
+    volts = np.array([start, stop])
+    magnitudes = np.abs(volts)
+    knee = SEGMENT_KNEE * magnitudes.max()
+    if magnitudes.min() < knee:
+        volts = np.insert(volts, 1, np.copysign(knee, volts[magnitudes.argmax()]))
+    change = np.abs(np.diff(volts))
+    # the slow segments take SEGMENT_SPEEDUP times as long per volt
+    slow = np.abs(volts[:-1] + volts[1:]) / 2 >= knee
+    durations = change * np.where(slow, SEGMENT_SPEEDUP, 1.0)
+    times = np.concatenate([[0.0], np.cumsum(durations)])
+    return np.interp(t, times / times[-1], volts)
+
+
+def profile_volts(
+    profile: RampProfile, start: float, stop: float, t: np.ndarray
+) -> np.ndarray:
+    """
+    The voltages of a ramp from start to stop at the fractions t of its time
+    """
+    if start == stop:
+        return np.full_like(t, stop, dtype=float)
+    if profile == RampProfile.SEGMENTED:
+        return segmented(start, stop, t)
+    return start + (stop - start) * SHAPES[profile](t)
+
+
+def setpoints(
+    profile: RampProfile, start: float, stop: float, steps: int
+) -> np.ndarray:
+    """
+    The steps setpoints that follow start in a ramp to stop, at equal
+    intervals of time, the last being exactly stop
+    """
+    volts = profile_volts(profile, start, stop, np.arange(1, steps + 1) / steps)
+    volts[-1] = stop
+    return volts
@@ -0,0 +1,84 @@
+"""
+Publication of readbacks to their records only when they change
+
+Every set() on a softioc In record processes it and posts a monitor to each
+Channel Access client, archiver and alarm handler, whether or not the value
+changed. A Publisher caches the last value posted to each record and, when
+flushed once per update loop iteration, posts only the records that moved
+outside their deadband in the meantime.
+"""
+
+from typing import Any, List, Optional
+
+
+class Published(object):
+    """
+    Stands in for an In record, staging values with set() until the
+    Publisher that owns it is flushed
+
+    A numeric value is posted when it differs from the last posted value by
+    more than both the absolute deadband and the relative deadband times the
+    last value, like the MDEL field of an EPICS record. With no deadbands any
+    change is posted.
+    """
+
+    def __init__(self, record, absolute: float = 0.0, relative: float = 0.0):
+        self.record = record
+        self.absolute = absolute
+        self.relative = relative
+        self.posted: Optional[Any] = None
+        self.value: Optional[Any] = None
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        """
+        The most recently staged value, without a record access
+        """
+        return self.value
+
+    def changed(self) -> bool:
+        if self.value is None:
+            return False
+        if self.posted is None:
+            return True
+        # float() as numpy booleans cannot be subtracted
+        delta = abs(float(self.value) - float(self.posted))
+        if not (self.absolute or self.relative):
+            return delta != 0
+        return delta > max(self.absolute, self.relative * abs(self.posted))
+
+    def post(self):
+        self.record.set(self.value)
+        self.posted = self.value
+
+
+class Publisher(object):
+    """
+    Coalesces the values staged on a group of Published records into at most
+    one post per record per flush
+    """
+
+    def __init__(self):
+        self.published: List[Published] = []
+        # total posts made, for comparison with the number of update iterations
+        self.posts = 0
+
+    def add(self, record, absolute: float = 0.0, relative: float = 0.0) -> Published:
+        published = Published(record, absolute, relative)
+        self.published.append(published)
+        return published
+
+    def flush(self) -> int:
+        """
+        Post every record whose staged value has left its deadband, returning
+        how many were posted
+        """
+        posts = 0
+        for published in self.published:
+            if published.changed():
+                published.post()
+                posts += 1
+        self.posts += posts
+        return posts
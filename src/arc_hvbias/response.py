@@ -0,0 +1,84 @@
+"""
+Decoding of replies from the Keithley into numpy arrays, in either the ASCII
+or the binary data format selected with :FORMAT:DATA
+"""
+
+from enum import IntEnum
+from typing import Optional
+
+import numpy as np
+
+# bytes in the '#0' header and line feed terminator of a binary reply
+BLOCK_OVERHEAD = 3
+
+
+class ResponseError(ValueError):
+    """
+    A reply from the instrument that could not be decoded
+    """
+
+    def __init__(self, message: str, reply):
+        super().__init__(f"{message}: {reply!r}")
+        self.reply = reply
+
+
+class DataFormat(IntEnum):
+    """
+    Formats for readings returned by :TRACE:DATA?, :READ? and :FETCH?
+    """
+
+    ASCII = 0
+    REAL32 = 1
+
+
+def format_commands(data_format: DataFormat, little_endian: bool = True) -> str:
+    if data_format == DataFormat.ASCII:
+        return ":FORMAT:DATA ASCII"
+    order = "SWAP" if little_endian else "NORMAL"
+    return f":FORMAT:DATA REAL,32;:FORMAT:BORDER {order}"
+
+
+def parse_format(data_format: str) -> DataFormat:
+    """
+    Interpret the reply to :FORMAT:DATA?
+    """
+    if data_format.upper().startswith(("REAL", "SRE")):
+        return DataFormat.REAL32
+    if data_format.upper().startswith("ASC"):
+        return DataFormat.ASCII
+    raise ResponseError("unknown data format", data_format)
+
+
+def block_size(count: int) -> int:
+    """
+    The number of bytes in a binary reply of count values
+    """
+    return count * 4 + BLOCK_OVERHEAD
+
+
+def decode_ascii(reply: str, count: Optional[int] = None) -> np.ndarray:
+    """
+    Convert a reply of ',' or ';' separated numbers in a single step
+
+    count, if given, is the number of values the reply must contain
+    """
+    if not reply.strip():
+        raise ResponseError("no reply", reply)
+    fields = reply.strip().replace(";", ",").split(",")
+    try:
+        values = np.array(fields, dtype=float)
+    except ValueError:
+        raise ResponseError("non-numeric reply", reply)
+    if count is not None and len(values) != count:
+        raise ResponseError(f"expected {count} values, got {len(values)}", reply)
+    return values
+
+
+def decode_block(data: bytes, count: int, little_endian: bool = True) -> np.ndarray:
+    """
+    View a binary reply of count 32 bit floats as an array without copying
+    """
+    if len(data) != block_size(count) or not data.startswith(b"#0"):
+        raise ResponseError(f"expected a block of {count} values", data[:16])
+    dtype = "<f4" if little_endian else ">f4"
+    return np.frombuffer(data, dtype=dtype, offset=2, count=count)
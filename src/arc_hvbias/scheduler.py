@@ -0,0 +1,233 @@
+"""
+Coordination of depolarisation cycles across several Keithley supplies
+
+Depolarising every detector module at once blanks the whole detector, while
+cycling them one at a time takes the sum of their cycle times. The scheduler
+offers three compromises:
+
+- SIMULTANEOUS: all modules cycle together, each ramp and hold starting on
+  every supply at the same moment so the dead time is that of one cycle
+- STAGGERED: each module starts its cycle when the previous one is within
+  OVERLAP seconds of finishing
+- ROLLING: modules cycle in turn with never more than CONCURRENCY of them
+  depolarised at once
+
+The cycles that modules call for by themselves, after MAX-TIME, in an idle
+gap or on a drifting leakage current, are queued and started in the same
+rolling way, so that modules that all become due at once take turns.
+"""
+
+from enum import IntEnum
+from time import monotonic
+from typing import List
+
+import cothread
+from softioc import builder
+
+from .hvbias import HvBias
+
+DEFAULT_SCHEDULER_PREFIX = "BL15J-EA-HV-ALL"
+# how often queued cycles look for cycles started by others having finished
+DISPATCH_POLL = 0.1
+
+
+class CycleMode(IntEnum):
+    SIMULTANEOUS = 0
+    STAGGERED = 1
+    ROLLING = 2
+
+
+class Barrier(object):
+    """
+    Blocks cothreads in wait() until all parties have arrived
+
+    A party that will not arrive again, e.g. because its cycle was aborted,
+    must leave() so that it does not hold up the others.
+    """
+
+    def __init__(self, parties: int):
+        self.parties = parties
+        self.waiting = 0
+        self.release = cothread.Event(auto_reset=False)
+
+    def wait(self):
+        self.waiting += 1
+        release = self.release
+        if self.waiting >= self.parties:
+            self.trip()
+        else:
+            release.Wait()
+
+    def leave(self):
+        self.parties -= 1
+        if self.waiting and self.waiting >= self.parties:
+            self.trip()
+
+    def trip(self):
+        # a fresh event for the next phase so that late waiters block on it
+        self.waiting = 0
+        release, self.release = self.release, cothread.Event(auto_reset=False)
+        release.Signal()
+
+
+class CycleScheduler(object):
+    """
+    The PVs to run a depolarisation cycle on several HvBias devices
+    """
+
+    def __init__(self, devices: List[HvBias], prefix: str = DEFAULT_SCHEDULER_PREFIX):
+        self.devices = devices
+
+        builder.SetDeviceName(prefix)
+
+        self.cmd_cycle = builder.boolOut(
+            "CYCLE", always_update=True, on_update=self.do_start_cycle
+        )
+        self.cmd_stop = builder.boolOut(
+            "STOP", always_update=True, on_update=self.do_stop
+        )
+        self.mode = builder.mbbOut("CYCLE-MODE", *CycleMode.__members__)
+        self.overlap = builder.aOut("OVERLAP", EGU="Sec", PREC=2)
+        self.concurrency = builder.longOut("CONCURRENCY", initial_value=1, LOPR=1)
+
+        self.cycle_rbv = builder.mbbIn("CYCLE_RBV", "IDLE", "RUNNING")
+        self.duration_rbv = builder.aIn("DURATION", EGU="Sec", PREC=2)
+
+        self.abort_flag = False
+
+        # devices waiting for a cycle they called for, and those running one
+        self.queue: List[HvBias] = []
+        self.running: List[HvBias] = []
+        self.done = cothread.Event()
+        self.dispatching = False
+        if len(devices) > 1:
+            for device in devices:
+                device.on_cycle_due = self.request_cycle
+
+    def do_start_cycle(self, do: int):
+        if do == 1 and not self.cycle_rbv.get():
+            cothread.Spawn(self.run, CycleMode(self.mode.get()))
+
+    def do_stop(self, stop: int):
+        if stop == 1:
+            self.abort_flag = True
+            self.queue.clear()
+            for device in self.devices:
+                device.do_stop(1)
+
+    def run(self, mode: CycleMode):
+        """
+        Cycle every idle device according to mode and publish the total time
+        """
+        # a device already cycling on its own is left alone
+        devices = [device for device in self.devices if not device.cycle_rbv.get()]
+        self.abort_flag = False
+        self.cycle_rbv.set(True)
+        start = monotonic()
+        try:
+            if mode == CycleMode.SIMULTANEOUS:
+                self.run_simultaneous(devices)
+            elif mode == CycleMode.STAGGERED:
+                self.run_staggered(devices, self.overlap.get())
+            else:
+                self.run_rolling(devices, max(self.concurrency.get(), 1))
+        finally:
+            self.duration_rbv.set(monotonic() - start)
+            self.cycle_rbv.set(False)
+
+    def run_simultaneous(self, devices: List[HvBias]):
+        barrier = Barrier(len(devices))
+        for device in devices:
+            device.barrier = barrier
+        self.wait_all([cothread.Spawn(d.cycle_control) for d in devices])
+
+    def run_staggered(self, devices: List[HvBias], overlap: float):
+        tasks = []
+        for i, device in enumerate(devices):
+            if self.abort_flag:
+                break
+            tasks.append(cothread.Spawn(device.cycle_control))
+            if i < len(devices) - 1:
+                # start the next device overlap seconds before this one ends
+                self.sleep(device.plan().duration - overlap)
+        self.wait_all(tasks)
+
+    def run_rolling(self, devices: List[HvBias], concurrency: int):
+        done = cothread.Event()
+        running: List[HvBias] = []
+
+        def cycle(device: HvBias):
+            try:
+                device.cycle_control()
+            finally:
+                running.remove(device)
+                done.Signal()
+
+        for device in devices:
+            while len(running) >= concurrency:
+                done.Wait()
+            if self.abort_flag:
+                break
+            running.append(device)
+            cothread.Spawn(cycle, device)
+        while running:
+            done.Wait()
+
+    def request_cycle(self, device: HvBias):
+        """
+        Queue a cycle that device has called for by itself
+        """
+        if device in self.queue or device in self.running or device.cycle_rbv.get():
+            return
+        self.queue.append(device)
+        if not self.dispatching:
+            self.dispatching = True
+            cothread.Spawn(self.dispatch)
+
+    def dispatch(self):
+        """
+        Start the queued cycles in turn, with never more than CONCURRENCY
+        devices cycling at once, including those cycled by CYCLE
+        """
+        try:
+            while self.queue:
+                if self.cycling() >= max(self.concurrency.get(), 1):
+                    self.wait_done()
+                    continue
+                device = self.queue.pop(0)
+                if not device.cycle_rbv.get():
+                    self.running.append(device)
+                    cothread.Spawn(self.cycle, device)
+        finally:
+            self.dispatching = False
+
+    def cycle(self, device: HvBias):
+        try:
+            device.cycle_control()
+        finally:
+            self.running.remove(device)
+            self.done.Signal()
+
+    def cycling(self) -> int:
+        others = [
+            d for d in self.devices if d.cycle_rbv.get() and d not in self.running
+        ]
+        return len(self.running) + len(others)
+
+    def wait_done(self):
+        try:
+            self.done.Wait(DISPATCH_POLL)
+        except cothread.Timedout:
+            pass
+
+    def sleep(self, seconds: float):
+        """
+        Sleep for up to seconds, returning early on STOP
+        """
+        deadline = monotonic() + seconds
+        while not self.abort_flag and monotonic() < deadline:
+            cothread.Sleep(min(deadline - monotonic(), 0.1))
+
+    def wait_all(self, tasks):
+        for task in tasks:
+            task.Wait()
@@ -0,0 +1,312 @@
+"""
+A simulated Keithley 2400 on a pseudo terminal, so that the IOC, the ramps
+and the benchmarks can run without the instrument
+
+Only the subset of SCPI used by arc_hvbias is modelled. Replies are delayed
+by a configurable processing latency plus the time the bytes would take on a
+serial line at the configured baud rate, and the output voltage slews towards
+the programmed level at a finite rate.
+"""
+
+import os
+import pty
+import threading
+import time
+import tty
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+
+IDN = "KEITHLEY INSTRUMENTS INC.,MODEL 2400,0000000,C32 (simulated)"
+
+# headers that are accepted but have no effect on the model
+IGNORED = {
+    "SYST:BEEP:STAT",
+    "SENSE:FUNCTION:ON",
+    "SENSE:CURRENT:RANGE:AUTO",
+    "SENSE:VOLTAGE:RANGE:AUTO",
+    "SENSE:VOLTAGE:DC:RANGE:AUTO",
+    "SOURCE:VOLTAGE:RANGE:AUTO",
+    "SOURCE:FUNCTION:MODE",
+    "SOURCE:SWEEP:SPACING",
+    "SOURCE:DELAY:AUTO",
+    "TRIGGER:SEQ1:SOURCE",
+    "TRACE:FEED",
+    "TRACE:FEED:CONTROL",
+    "*CLS",
+}
+
+# the order of the values in each trace buffer reading
+READING = ("VOLT", "CURR", "TIME")
+# how long stop() waits for the model thread to finish
+STOP_TIMEOUT = 1.0
+# the simulated power line frequency in Hz
+LINE_FREQUENCY = 50.0
+# the functions measured in each reading, each integrated in turn
+FUNCTIONS = 2
+
+
+class SimulatedKeithley(object):
+    """
+    Model of a Keithley 2400 answering SCPI on the slave side of a pty
+
+    Open port with Keithley(port=simulator.port) after calling start().
+    The model runs in its own thread so that, like the real instrument,
+    it is unaffected by the load on the IOC's cothread scheduler.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.002,
+        baud: int = 34800,
+        slew_rate: float = 1000.0,
+        leakage_resistance: float = 1e9,
+        capacitance: float = 1e-9,
+    ):
+        self.latency = latency
+        self.baud = baud
+        self.slew_rate = slew_rate
+        self.leakage_resistance = leakage_resistance
+        self.capacitance = capacitance
+
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+        self.handlers: Dict[str, Callable[[str], Union[str, bytes]]] = {
+            "*RST": self.reset,
+            "*IDN?": lambda _: IDN,
+            "*OPC?": lambda _: "1",
+            "ABORT": lambda _: "",
+            "INIT": self.init,
+            "OUTPUT:STATE": self.set_output,
+            "OUTPUT:STATE?": lambda _: str(int(self.output)),
+            "SOURCE:CLEAR:IMMEDIATE": lambda _: self.set_output("OFF"),
+            "SOURCE:VOLTAGE": self.set_level,
+            "SOURCE:VOLTAGE?": lambda _: f"{self.level:E}",
+            "SOURCE:CURRENT?": lambda _: f"{0.0:E}",
+            "SENSE:CURRENT:PROTECTION": self.setter("compliance", float),
+            "SENSE:CURRENT:NPLCYCLES": self.setter("nplc", float),
+            "SYSTEM:AZERO:STATE": self.setter(
+                "auto_zero", lambda arg: arg.upper() == "ON"
+            ),
+            "SYSTEM:LFREQUENCY?": lambda _: f"{LINE_FREQUENCY:E}",
+            "SOURCE:DELAY": self.setter("source_delay", float),
+            "READ?": self.read,
+            "SOURCE:VOLTAGE:MODE": self.set_mode,
+            "SOURCE:VOLTAGE:START": self.setter("sweep_start", float),
+            "SOURCE:VOLTAGE:STOP": self.setter("sweep_stop", float),
+            "SOURCE:SWEEP:POINTS": self.setter("sweep_points", int),
+            "SOURCE:LIST:VOLTAGE": self.setter(
+                "list_volts", lambda arg: [float(v) for v in arg.split(",")]
+            ),
+            "SOURCE:LIST:VOLTAGE:APPEND": self.append_list,
+            "TRIGGER:CLEAR": lambda _: "",
+            "TRIGGER:SEQ1:COUNT": self.setter("trigger_count", int),
+            "TRIGGER:SEQ1:DELAY": self.setter("trigger_delay", float),
+            "TRACE:CLEAR": self.clear_trace,
+            "TRACE:POINTS": self.setter("trace_points", int),
+            "TRACE:POINTS:ACTUAL?": lambda _: str(len(self.trace)),
+            "TRACE:DATA?": self.trace_data,
+            "FORMAT:DATA": self.setter("data_format", str.upper),
+            "FORMAT:DATA?": self.get_format,
+            "FORMAT:BORDER": self.setter("byte_order", str.upper),
+            "FORMAT:BORDER?": lambda _: self.byte_order[:4],
+            "FORMAT:ELEMENTS": self.set_elements,
+        }
+        self.reset("")
+
+    def start(self) -> "SimulatedKeithley":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        # the model thread sees the pty hang up once nothing has the slave
+        # open, and must have stopped reading before the master is closed in
+        # case its descriptor is reused by another simulator
+        os.close(self.slave)
+        if self.thread.is_alive():
+            self.thread.join(STOP_TIMEOUT)
+        os.close(self.master)
+
+    def reset(self, _) -> str:
+        self.level = 0.0
+        self.voltage = 0.0
+        self.dv_dt = 0.0
+        self.updated = time.monotonic()
+        self.reset_time = self.updated
+        self.output = False
+        self.mode = "FIXED"
+        self.sweep_start = 0.0
+        self.sweep_stop = 0.0
+        self.sweep_points = 2500
+        self.list_volts = [0.0]
+        self.trigger_count = 1
+        self.trigger_delay = 0.0
+        self.trace_points = 100
+        self.compliance = 105e-6
+        self.nplc = 1.0
+        self.auto_zero = True
+        self.source_delay = 0.001
+        self.trace: List[Tuple[float, float, float]] = []
+        self.data_format = "ASC"
+        self.byte_order = "NORM"
+        self.elements = list(READING)
+        return ""
+
+    def setter(self, name: str, convert: Callable) -> Callable[[str], str]:
+        def set_value(arg: str) -> str:
+            setattr(self, name, convert(arg))
+            return ""
+
+        return set_value
+
+    def slew(self):
+        """
+        Move the output voltage towards the programmed level
+        """
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        target = self.level if self.output else 0.0
+        difference = target - self.voltage
+        limit = self.slew_rate * elapsed
+        change = max(min(difference, limit), -limit)
+        self.voltage += change
+        self.dv_dt = change / elapsed if elapsed > 0 else 0.0
+
+    def current(self) -> float:
+        self.slew()
+        if not self.output:
+            return 0.0
+        amps = self.voltage / self.leakage_resistance + self.capacitance * self.dv_dt
+        # the instrument clamps the current at its compliance
+        return max(min(amps, self.compliance), -self.compliance)
+
+    def set_output(self, arg: str) -> str:
+        self.slew()
+        self.output = arg.upper() in ("ON", "1")
+        return ""
+
+    def set_level(self, arg: str) -> str:
+        self.slew()
+        self.level = float(arg)
+        return ""
+
+    def set_mode(self, arg: str) -> str:
+        self.mode = arg.upper()
+        return ""
+
+    def append_list(self, arg: str) -> str:
+        self.list_volts += [float(v) for v in arg.split(",")]
+        return ""
+
+    def clear_trace(self, _) -> str:
+        self.trace = []
+        return ""
+
+    def init(self, _) -> str:
+        """
+        Run the trigger model, blocking further commands until it completes
+        """
+        self.trigger()
+        return ""
+
+    def read(self, _) -> Union[str, bytes]:
+        """
+        Run the trigger model and return its readings, like :INIT then :FETCH?
+        """
+        return self.format_readings(self.trigger())
+
+    def reading_time(self) -> float:
+        """
+        Seconds to settle and integrate each reading, auto zero taking a
+        reference and a zero integration as well as each function's own
+        """
+        conversions = FUNCTIONS * (3 if self.auto_zero else 1)
+        return self.source_delay + conversions * self.nplc / LINE_FREQUENCY
+
+    def trigger(self) -> List[Tuple[float, float, float]]:
+        readings = []
+        fixed_level = self.level
+        for point in range(self.trigger_count):
+            time.sleep(self.trigger_delay + self.reading_time())
+            if self.mode == "SWEEP":
+                fraction = point / max(self.sweep_points - 1, 1)
+                self.level = self.sweep_start + fraction * (
+                    self.sweep_stop - self.sweep_start
+                )
+            elif self.mode == "LIST":
+                self.level = self.list_volts[point % len(self.list_volts)]
+            reading = (self.level, self.current(), time.monotonic() - self.reset_time)
+            readings.append(reading)
+            if len(self.trace) < self.trace_points:
+                self.trace.append(reading)
+        self.level = fixed_level
+        return readings
+
+    def set_elements(self, arg: str) -> str:
+        self.elements = [element.strip()[:4].upper() for element in arg.split(",")]
+        return ""
+
+    def get_format(self, _) -> str:
+        if self.data_format.startswith("REAL"):
+            return "REAL,32"
+        return self.data_format[:3]
+
+    def trace_data(self, _) -> Union[str, bytes]:
+        return self.format_readings(self.trace)
+
+    def format_readings(
+        self, readings: List[Tuple[float, float, float]]
+    ) -> Union[str, bytes]:
+        columns = [READING.index(element) for element in self.elements]
+        values = np.array(readings).reshape(-1, len(READING))[:, columns]
+        if self.data_format.startswith("ASC"):
+            return ",".join(f"{value:E}" for value in values.flat)
+        dtype = "<f4" if self.byte_order == "SWAP" else ">f4"
+        return b"#0" + values.astype(dtype).tobytes()
+
+    def handle(self, command: str) -> Union[str, bytes]:
+        """
+        Execute a single SCPI command and return its reply
+        """
+        header, _, arg = command.strip().partition(" ")
+        header = header.upper().lstrip(":")
+        if not header or header in IGNORED:
+            return ""
+        handler = self.handlers.get(header)
+        if handler is None:
+            print(f"simulator: unsupported command {command}")
+            return ""
+        return handler(arg.strip())
+
+    def respond(self, line: str):
+        # compound commands are separated by ';' and so are their replies
+        replies = [self.handle(command) for command in line.split(";")]
+        encoded = [
+            reply if isinstance(reply, bytes) else reply.encode()
+            for reply in replies
+            if reply
+        ]
+        time.sleep(self.latency)
+        if encoded:
+            data = b";".join(encoded) + b"\n"
+            time.sleep(len(data) * 10 / self.baud)
+            os.write(self.master, data)
+
+    def run(self):
+        buffer = b""
+        while True:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                # the pty has been closed
+                return
+            # model the time taken for the command to arrive over the wire
+            time.sleep(len(data) * 10 / self.baud)
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                self.respond(line.decode())
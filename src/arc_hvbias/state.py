@@ -0,0 +1,76 @@
+"""
+Tracking of the bias state of the supply from its readbacks, with a
+tolerance on the voltage and a settling time before a change is accepted
+"""
+
+import math
+from enum import IntEnum
+from typing import Optional
+
+# default volts within which the output is considered to be at a setpoint
+DEFAULT_TOLERANCE = 1.0
+# default seconds a new state must persist before it is accepted
+DEFAULT_SETTLE_TIME = 0.5
+
+
+class BiasState(IntEnum):
+    OUTPUT_OFF = 0
+    AT_OFF = 1
+    BETWEEN = 2
+    AT_ON = 3
+
+
+class StateTracker(object):
+    """
+    Classifies each readback as a BiasState and debounces the result
+
+    A readback that differs from the tracked state only changes it once
+    every readback for settle_time seconds has agreed, so that rounding,
+    noise and the tail of a ramp do not make the state flap. The first
+    readback is accepted immediately.
+    """
+
+    def __init__(
+        self,
+        tolerance: float = DEFAULT_TOLERANCE,
+        settle_time: float = DEFAULT_SETTLE_TIME,
+    ):
+        self.tolerance = tolerance
+        self.settle_time = settle_time
+        self.state: Optional[BiasState] = None
+        self.candidate: Optional[BiasState] = None
+        self.candidate_since = 0.0
+        # when the tracked state last changed
+        self.changed = 0.0
+
+    def classify(
+        self, volts: float, output: int, on_volts: float, off_volts: float
+    ) -> BiasState:
+        if not output:
+            return BiasState.OUTPUT_OFF
+        if abs(volts + math.fabs(on_volts)) <= self.tolerance:
+            return BiasState.AT_ON
+        if abs(volts + math.fabs(off_volts)) <= self.tolerance:
+            return BiasState.AT_OFF
+        return BiasState.BETWEEN
+
+    def update(
+        self, now: float, volts: float, output: int, on_volts: float, off_volts: float
+    ) -> BiasState:
+        """
+        Add a readback taken at now and return the tracked state
+        """
+        state = self.classify(volts, output, on_volts, off_volts)
+        if self.state is None:
+            self.state = state
+            self.changed = now
+        elif state == self.state:
+            self.candidate = None
+        elif state != self.candidate:
+            self.candidate = state
+            self.candidate_since = now
+        elif now - self.candidate_since >= self.settle_time:
+            self.state = state
+            self.changed = now
+            self.candidate = None
+        return self.state
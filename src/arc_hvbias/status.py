@@ -8,3 +8,5 @@ class Status(IntEnum):
     HOLD = 3
     RAMP_DOWN = 4
     ERROR = 5
+    # a whole cycle running from the source list
+    LIST_CYCLE = 6
@@ -0,0 +1,111 @@
+"""
+Supervision of the serial link to a Keithley, recovering from faults
+
+A timeout or a garbled reply usually means that the replies have got out of
+step with the queries, e.g. because a reply arrived after its query had
+timed out. The supervisor first resynchronises the link in place. If that
+fails, or the port itself has failed, the port is closed and reopened at
+growing intervals until the instrument answers again.
+"""
+
+from time import monotonic
+from typing import Callable, Optional
+
+import cothread
+
+from .keithley import Keithley
+
+# seconds before the first retry of a failed connection, doubling on each
+# further failure up to the maximum
+CONNECT_RETRY = 1.0
+CONNECT_RETRY_MAX = 30.0
+
+
+class LinkSupervisor(object):
+    """
+    Connects a Keithley and keeps it connected, counting the faults seen
+    """
+
+    def __init__(self, k: Keithley, on_change: Optional[Callable[[bool], None]] = None):
+        self.k = k
+        # called with True when the link comes up and False when it goes down
+        self.on_change = on_change
+        self.errors = 0
+        self.resyncs = 0
+        self.reconnects = 0
+        self.up_since: Optional[float] = None
+        # set by close() to stop connecting and recovering
+        self.closed = False
+        # set while recover() is under way, which other callers wait for
+        self.recovering = False
+        self.recovered = cothread.Event(auto_reset=False)
+
+    @property
+    def uptime(self) -> float:
+        """
+        Seconds since the link last came up, 0 while it is down
+        """
+        return 0.0 if self.up_since is None else monotonic() - self.up_since
+
+    def connect(self):
+        """
+        Connect, retrying at growing intervals until the instrument answers
+        """
+        retry = CONNECT_RETRY
+        while not self.closed:
+            try:
+                self.k.connect()
+            except (OSError, ValueError) as e:
+                # including SerialException and ResponseError
+                print(f"cannot connect to {self.k.transport.port}: {e}")
+                cothread.Sleep(retry)
+                retry = min(retry * 2, CONNECT_RETRY_MAX)
+                continue
+            self.up_since = monotonic()
+            self.changed(True)
+            return
+
+    def recover(self, error: Exception):
+        """
+        Called with the error from a failed exchange with the instrument:
+        resynchronise the link, or reconnect if that does not work
+
+        The update loop and the capture both poll the instrument, so an error
+        seen by one while the other is recovering waits for that instead.
+        """
+        if self.closed:
+            return
+        if self.recovering:
+            self.recovered.Wait()
+            return
+        self.recovering = True
+        self.recovered.Reset()
+        try:
+            self.restore(error)
+        finally:
+            self.recovering = False
+            self.recovered.Signal()
+
+    def restore(self, error: Exception):
+        self.errors += 1
+        if self.k.transport.is_open:
+            self.resyncs += 1
+            if self.k.resync():
+                return
+        print(f"link to {self.k.transport.port} lost: {error}")
+        self.reconnects += 1
+        self.k.disconnect()
+        self.up_since = None
+        self.changed(False)
+        self.connect()
+
+    def close(self):
+        """
+        Disconnect for good, e.g. when the IOC is shutting down
+        """
+        self.closed = True
+        self.k.disconnect()
+
+    def changed(self, up: bool):
+        if self.on_change is not None:
+            self.on_change(up)
@@ -0,0 +1,328 @@
+"""
+Owns the serial port to the Keithley and serialises the commands sent to it
+from the update loop, ramp workers and PV callbacks
+"""
+
+import heapq
+import itertools
+from collections import deque
+from enum import IntEnum
+from time import monotonic
+from typing import Deque, List, Optional, Tuple
+
+import cothread
+import serial
+
+from .profiler import LatencyProfiler, classify
+
+# how long to wait for a reply to a query before giving up on it
+REPLY_TIMEOUT = 1.0
+# the maximum number of queries written ahead of their replies
+PIPELINE_DEPTH = 4
+
+
+class Priority(IntEnum):
+    """
+    Order in which queued commands are sent to the instrument, lowest first
+    """
+
+    ABORT = 0
+    RAMP = 1
+    READBACK = 2
+
+
+class Request(object):
+    """
+    A single command waiting in the queue, optionally expecting a reply
+
+    Replies are a line of text unless size is given, in which case exactly
+    size bytes of binary data are returned.
+    """
+
+    def __init__(
+        self, command: str, respond: bool, timeout: float, size: Optional[int] = None
+    ):
+        self.command = command
+        self.respond = respond
+        self.timeout = timeout
+        self.size = size
+        self.sent = 0.0
+        # set once the command has been written to the port
+        self.written = False
+        self.done = cothread.Event()
+
+
+class Transport(object):
+    """
+    Prioritised command queue in front of a serial port
+
+    A writer cothread takes the highest priority request from the queue
+    and writes it to the port while up to PIPELINE_DEPTH earlier queries
+    are still waiting for their replies. A reader cothread matches reply
+    lines to the outstanding queries in the order they were written.
+    Neither blocks the cothread scheduler while waiting on the port.
+
+    The port is not opened until open() is called, and commands sent while
+    it is closed return at once with an empty reply.
+    """
+
+    def __init__(
+        self,
+        port: str,
+        baud: int = 34800,
+        bytesize: int = 8,
+        parity: str = "N",
+        depth: int = PIPELINE_DEPTH,
+    ):
+        self.port = port
+        # a zero timeout makes reads non-blocking, we poll the fd instead
+        self.ser = serial.Serial(
+            None, baud, bytesize=bytesize, parity=parity, timeout=0
+        )
+        self.depth = depth
+
+        self.queue: List[Tuple[int, int, Request]] = []
+        self.in_flight: Deque[Request] = deque()
+        self.order = itertools.count()
+        self.wake_writer = cothread.Event()
+        self.wake_reader = cothread.Event()
+        self.buffer = b""
+        # the most bytes seen waiting in the port's output buffer after a
+        # write, which an abort may have to wait behind
+        self.max_backlog = 0
+
+        # throughput statistics
+        self.commands_sent = 0
+        self.replies_received = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.profiler = LatencyProfiler()
+
+    @property
+    def is_open(self) -> bool:
+        return self.ser.is_open
+
+    def open(self):
+        """
+        Open the port and start the worker cothreads, raising SerialException
+        if the port cannot be opened
+        """
+        if self.ser.is_open:
+            return
+        # a new port object each time, so that workers left over from before
+        # a close() see their own port closed and exit
+        self.ser = serial.Serial(
+            self.port,
+            self.ser.baudrate,
+            bytesize=self.ser.bytesize,
+            parity=self.ser.parity,
+            timeout=0,
+        )
+        self.buffer = b""
+        cothread.Spawn(self.writer, self.ser)
+        cothread.Spawn(self.reader, self.ser)
+
+    def close(self):
+        """
+        Close the port, stop the worker cothreads and release any callers
+        still waiting for a reply
+        """
+        self.ser.close()
+        for _, _, request in self.queue:
+            request.done.Signal("")
+        for request in self.in_flight:
+            request.done.Signal("")
+        self.queue.clear()
+        self.in_flight.clear()
+        self.wake_writer.Signal()
+        self.wake_reader.Signal()
+
+    def fail(self, error: Exception):
+        """
+        The port itself has failed, e.g. its USB adapter was unplugged, so
+        close it and leave reopening it to the caller
+        """
+        print(f"serial port {self.port} failed: {error}")
+        self.failures += 1
+        self.close()
+
+    def clear_input(self):
+        """
+        Discard reply bytes that have been received but not yet matched to a
+        query, e.g. a reply that arrived after its query timed out
+        """
+        self.buffer = b""
+        if self.ser.is_open:
+            self.ser.reset_input_buffer()
+
+    def send(
+        self,
+        command: str,
+        respond: bool = False,
+        priority=Priority.READBACK,
+        timeout: float = REPLY_TIMEOUT,
+    ) -> str:
+        """
+        Queue a command and wait until it has been written, or for queries
+        until the reply has been received. Returns the reply, or an empty
+        string if there was none within timeout seconds.
+        """
+        return self.submit(Request(command, respond, timeout), priority)
+
+    def write(self, command: str, priority=Priority.READBACK) -> bool:
+        """
+        Queue a command without a reply and wait until it has been written.
+        Returns False if it was not, because it was cancelled or the port
+        failed or was closed.
+        """
+        request = Request(command, False, REPLY_TIMEOUT)
+        self.submit(request, priority)
+        return request.written
+
+    def query_binary(
+        self,
+        command: str,
+        size: int,
+        priority=Priority.READBACK,
+        timeout: float = REPLY_TIMEOUT,
+    ) -> bytes:
+        """
+        Queue a query with a binary reply of size bytes and wait for it.
+        Returns the raw reply, or empty bytes if it was incomplete after
+        timeout seconds.
+        """
+        return self.submit(Request(command, True, timeout, size), priority)
+
+    def cancel(self, priority: int):
+        """
+        Drop the queued requests of priority that have not yet been written,
+        releasing their callers with an empty reply
+        """
+        kept = []
+        for item in self.queue:
+            request = item[2]
+            if item[0] == priority:
+                request.done.Signal("" if request.size is None else b"")
+            else:
+                kept.append(item)
+        heapq.heapify(kept)
+        self.queue = kept
+
+    def write_time(self, command: str) -> float:
+        """
+        The longest a command written now should take to reach the wire,
+        behind the largest backlog seen so far
+        """
+        return (self.max_backlog + len(command) + 1) * 10 / self.ser.baudrate
+
+    def submit(self, request: Request, priority: int):
+        if not self.ser.is_open:
+            return "" if request.size is None else b""
+        heapq.heappush(self.queue, (priority, next(self.order), request))
+        self.wake_writer.Signal()
+        return request.done.Wait()
+
+    def writer(self, ser: serial.Serial):
+        while True:
+            # aborts are written even when the pipeline is full
+            while not self.queue or (
+                len(self.in_flight) >= self.depth and self.queue[0][0] != Priority.ABORT
+            ):
+                if not ser.is_open:
+                    return
+                self.wake_writer.Wait()
+
+            # wait cooperatively for room in the port's output buffer so that
+            # a slow port does not stall the other instruments in the process
+            cothread.poll_list([(ser.fileno(), cothread.POLLOUT)])
+            if not ser.is_open:
+                return
+
+            _, _, request = heapq.heappop(self.queue)
+            request.sent = monotonic()
+            try:
+                ser.write((request.command + "\n").encode())
+                backlog = ser.out_waiting
+            except OSError as e:
+                # including SerialException
+                request.done.Signal("" if request.size is None else b"")
+                self.fail(e)
+                return
+            request.written = True
+            self.commands_sent += 1
+            self.max_backlog = max(self.max_backlog, backlog)
+
+            if request.respond:
+                self.in_flight.append(request)
+                self.wake_reader.Signal()
+            else:
+                # include the time for the bytes still queued to reach the wire
+                wire = backlog * 10 / ser.baudrate
+                self.profiler.record(
+                    classify(request.command, False), monotonic() - request.sent + wire
+                )
+                request.done.Signal("")
+
+    def reader(self, ser: serial.Serial):
+        while True:
+            while not self.in_flight:
+                if not ser.is_open:
+                    return
+                self.wake_reader.Wait()
+
+            request = self.in_flight[0]
+            try:
+                reply = self.read(ser, request.size, request.sent + request.timeout)
+            except OSError as e:
+                # including SerialException
+                self.fail(e)
+                return
+            if not ser.is_open:
+                return
+            self.in_flight.popleft()
+
+            if reply is None:
+                # discard any partial reply so the next one is not corrupted
+                self.buffer = b""
+                self.timeouts += 1
+                request.done.Signal("" if request.size is None else b"")
+            else:
+                # replies held back on purpose, such as *OPC? at the end of a
+                # trace, and bulk transfers do not measure the link's latency
+                if request.size is None and request.timeout <= REPLY_TIMEOUT:
+                    self.profiler.record(
+                        classify(request.command, True), monotonic() - request.sent
+                    )
+                self.replies_received += 1
+                if request.size is None:
+                    request.done.Signal(reply.decode().strip())
+                else:
+                    request.done.Signal(reply)
+
+            # there is room in the pipeline for another query
+            self.wake_writer.Signal()
+
+    def complete(self, size: Optional[int]) -> bool:
+        if size is None:
+            return b"\n" in self.buffer
+        return len(self.buffer) >= size
+
+    def read(
+        self, ser: serial.Serial, size: Optional[int], deadline: float
+    ) -> Optional[bytes]:
+        """
+        Cooperatively read size bytes from the port, or one line if size is
+        None. Returns None if the reply is incomplete at the deadline.
+        """
+        while not self.complete(size):
+            remaining = deadline - monotonic()
+            if remaining <= 0 or not ser.is_open:
+                return None
+            ready = cothread.poll_list([(ser.fileno(), cothread.POLLIN)], remaining)
+            # the port may have been closed while we were waiting
+            if ready and ser.is_open:
+                self.buffer += ser.read(ser.in_waiting or 1)
+
+        end = self.buffer.index(b"\n") + 1 if size is None else size
+        reply, self.buffer = self.buffer[:end], self.buffer[end:]
+        return reply
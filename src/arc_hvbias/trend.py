@@ -0,0 +1,105 @@
+"""
+Detection of polarisation build up from the drift of the leakage current
+
+As a sensor polarises under bias its leakage current drifts. A TrendEstimator
+fits a straight line to the current over a sliding window of recent samples,
+updating running sums as samples enter and leave the window so that each
+update costs the same however long the window is.
+"""
+
+import math
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+# samples needed in the window before a slope is estimated
+MIN_SAMPLES = 10
+# how many windows the origin may fall behind the newest sample
+REBASE_WINDOWS = 4
+
+
+class TrendEstimator(object):
+    """
+    Least squares slope of (time, current) samples over the last window
+    seconds, with the mean current and its standard deviation
+
+    Times are kept relative to an origin within the last few windows, and
+    the sums are recomputed whenever the origin moves, so that they stay well
+    conditioned and free of accumulated rounding over a long uptime.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self.samples: Deque[Tuple[float, float]] = deque()
+        self.origin: Optional[float] = None
+        self.reset_sums()
+
+    def clear(self):
+        self.samples.clear()
+        self.origin = None
+        self.reset_sums()
+
+    def reset_sums(self):
+        self.n = 0
+        self.sum_t = self.sum_y = self.sum_tt = self.sum_ty = self.sum_yy = 0.0
+
+    def accumulate(self, t: float, y: float, sign: int):
+        self.n += sign
+        self.sum_t += sign * t
+        self.sum_y += sign * y
+        self.sum_tt += sign * t * t
+        self.sum_ty += sign * t * y
+        self.sum_yy += sign * y * y
+
+    def add(self, timestamp: float, current: float):
+        if self.origin is None:
+            self.origin = timestamp
+        t = timestamp - self.origin
+        self.samples.append((t, current))
+        self.accumulate(t, current, 1)
+        # keep the newest sample from before the window so that once there is
+        # enough history the samples span the whole window
+        while len(self.samples) > 1 and t - self.samples[1][0] >= self.window:
+            self.accumulate(*self.samples.popleft(), -1)
+        if t > REBASE_WINDOWS * self.window:
+            self.rebase()
+
+    def rebase(self):
+        """
+        Move the origin to the oldest sample and recompute the sums
+        """
+        shift = self.samples[0][0]
+        assert self.origin is not None
+        self.origin += shift
+        samples = [(t - shift, y) for t, y in self.samples]
+        self.samples.clear()
+        self.reset_sums()
+        for t, y in samples:
+            self.samples.append((t, y))
+            self.accumulate(t, y, 1)
+
+    @property
+    def span(self) -> float:
+        """
+        Seconds between the oldest and newest samples in the window
+        """
+        return self.samples[-1][0] - self.samples[0][0] if self.samples else 0.0
+
+    def slope(self) -> Optional[float]:
+        """
+        The trend in current per second, None until there are enough samples
+        """
+        if self.n < MIN_SAMPLES:
+            return None
+        variance = self.n * self.sum_tt - self.sum_t**2
+        if variance <= 0:
+            return None
+        return (self.n * self.sum_ty - self.sum_t * self.sum_y) / variance
+
+    def mean(self) -> Optional[float]:
+        return self.sum_y / self.n if self.n else None
+
+    def stdev(self) -> Optional[float]:
+        if self.n < 2:
+            return None
+        variance = (self.sum_yy - self.sum_y**2 / self.n) / (self.n - 1)
+        return math.sqrt(max(variance, 0.0))
@@ -0,0 +1,108 @@
+"""
+Triggering of depolarisation cycles in the gaps between detector acquisitions
+
+The detector publishes whether it is acquiring on a PV. An IdleTrigger
+follows that PV with a Channel Access monitor, keeps a history of how long
+the detector stays idle between acquisitions and, at the start of each idle
+period, starts a cycle if the gap it predicts is long enough to complete one.
+"""
+
+from collections import deque
+from time import monotonic
+from typing import Callable, Optional
+
+import numpy as np
+from cothread.catools import FORMAT_TIME, camonitor
+from softioc.alarm import INVALID_ALARM
+
+# number of recent gaps used for the prediction
+GAP_HISTORY = 20
+# the percentile of recent gaps that is taken as the next gap, low so that a
+# cycle rarely overruns into the next acquisition
+GAP_PERCENTILE = 20
+# gaps needed before any prediction is made
+MIN_GAPS = 3
+
+
+class GapPredictor(object):
+    """
+    Predicts the length of the next idle gap from the most recent gaps
+    """
+
+    def __init__(self, history: int = GAP_HISTORY):
+        self.gaps: deque = deque(maxlen=history)
+
+    def add(self, seconds: float):
+        self.gaps.append(seconds)
+
+    def predict(self) -> Optional[float]:
+        if len(self.gaps) < MIN_GAPS:
+            return None
+        return float(np.percentile(self.gaps, GAP_PERCENTILE))
+
+
+class IdleTrigger(object):
+    """
+    Calls start_cycle when the detector goes idle and the predicted gap is
+    at least required() seconds, and permitted() allows a cycle
+
+    A disconnected or INVALID acquiring PV is treated as acquiring so that a
+    cycle is never started blind.
+    """
+
+    def __init__(
+        self,
+        required: Callable[[], float],
+        permitted: Callable[[], bool],
+        start_cycle: Callable[[], None],
+        history: int = GAP_HISTORY,
+    ):
+        self.required = required
+        self.permitted = permitted
+        self.start_cycle = start_cycle
+        self.predictor = GapPredictor(history)
+        self.subscription = None
+        self.acquiring = True
+        self.idle_since: Optional[float] = None
+        # count of cycles started by this trigger
+        self.triggered = 0
+
+    def connect(self, pv: str):
+        """
+        Follow a new acquiring PV, or none if pv is empty
+        """
+        self.close()
+        if pv:
+            self.subscription = camonitor(
+                pv, self.on_update, format=FORMAT_TIME, notify_disconnect=True
+            )
+
+    def close(self):
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription = None
+        self.transition(True, monotonic())
+
+    def on_update(self, value):
+        unknown = not value.ok or value.severity == INVALID_ALARM
+        self.transition(unknown or bool(value), monotonic())
+
+    def transition(self, acquiring: bool, now: float):
+        if acquiring == self.acquiring:
+            return
+        self.acquiring = acquiring
+        if acquiring:
+            # a disconnect part way through a gap still ends it
+            if self.idle_since is not None:
+                self.predictor.add(now - self.idle_since)
+            self.idle_since = None
+        else:
+            self.idle_since = now
+            predicted = self.predictor.predict()
+            if (
+                predicted is not None
+                and predicted >= self.required()
+                and self.permitted()
+            ):
+                self.triggered += 1
+                self.start_cycle()
@@ -0,0 +1,30 @@
+"""
+Stands in for a detector's IOC in the trigger tests, serving PREFIX:ACQUIRING
+from another process. Each line on stdin sets the record: 0 or 1, or INVALID
+to put it into alarm without changing its value.
+"""
+
+import sys
+
+from softioc import alarm, builder, softioc
+
+
+def main(prefix: str):
+    builder.SetDeviceName(prefix)
+    acquiring = builder.boolIn(
+        "ACQUIRING", ZNAM="IDLE", ONAM="ACQUIRING", initial_value=1
+    )
+    builder.LoadDatabase()
+    softioc.iocInit()
+    print("ready", flush=True)
+
+    for line in sys.stdin:
+        command = line.strip().upper()
+        if command == "INVALID":
+            acquiring.set_alarm(alarm.INVALID_ALARM, alarm.UDF_ALARM)
+        elif command:
+            acquiring.set(int(command))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,56 @@
+import itertools
+from typing import Callable, Iterator, List, Tuple
+
+import cothread
+import pytest
+
+from arc_hvbias.config import Instrument
+from arc_hvbias.hvbias import HvBias
+from arc_hvbias.keithley import Keithley
+from arc_hvbias.simulator import SimulatedKeithley
+
+# record prefixes are unique in the process, so each device gets its own
+PREFIXES = (f"TEST-HV-{n:02d}" for n in itertools.count(1))
+# how long to wait for a device to connect to its simulator
+CONNECT_TIMEOUT = 5.0
+
+
+@pytest.fixture
+def keithley():
+    simulator = SimulatedKeithley().start()
+    k = Keithley(simulator.port)
+    k.connect()
+    k.source_on(1)
+    yield k
+    k.transport.close()
+    simulator.stop()
+
+
+@pytest.fixture
+def devices() -> Iterator[Callable[[], HvBias]]:
+    """
+    Makes HvBias devices on simulators, connected and polled by their update
+    loops, with their records unserved and set up for a short cycle
+    """
+    made: List[Tuple[HvBias, SimulatedKeithley]] = []
+
+    def make() -> HvBias:
+        simulator = SimulatedKeithley().start()
+        device = HvBias(Instrument(port=simulator.port, prefix=next(PREFIXES)))
+        made.append((device, simulator))
+        device.on_setpoint.set(50)
+        device.off_setpoint.set(0)
+        device.rise_time.set(0.5)
+        device.fall_time.set(0.5)
+        device.hold_time.set(0.2)
+        device.repeats.set(1)
+        device.step_size.set(5)
+        cothread.Spawn(device.update)
+        device.link_up.Wait(CONNECT_TIMEOUT)
+        device.k.source_on(1)
+        return device
+
+    yield make
+    for device, simulator in made:
+        device.close()
+        simulator.stop()
@@ -0,0 +1,47 @@
+from typing import List
+
+import cothread
+import numpy as np
+
+from arc_hvbias.capture import Capture, RingBuffer, downsample
+from arc_hvbias.keithley import Keithley
+from arc_hvbias.response import ResponseError
+
+
+def test_ring_buffer_wraps():
+    ring = RingBuffer(4)
+    for i in range(6):
+        ring.append(i, -i, i / 10)
+    assert len(ring) == 4
+    assert ring.latest(10)[:, 0].tolist() == [2, 3, 4, 5]
+    assert ring.since(4)[:, 0].tolist() == [4, 5]
+
+    ring.extend(np.array([[6, -6, 0.6], [7, -7, 0.7]]))
+    assert ring.latest(3)[:, 0].tolist() == [5, 6, 7]
+
+
+def test_downsample_averages_newest_blocks():
+    samples = np.arange(10.0).reshape(-1, 1)
+    assert downsample(samples, 20) is samples
+    assert downsample(samples, 4)[:, 0].tolist() == [2, 5, 8]
+
+
+def test_bad_replies_are_passed_on(keithley: Keithley):
+    errors: List[ResponseError] = []
+    capture = Capture(keithley, errors.append)
+    keithley.transport.fail(OSError("unplugged"))
+    capture.arm()
+    cothread.Sleep(0.3)
+    capture.disarm()
+    assert errors and all(isinstance(e, ResponseError) for e in errors)
+
+
+def test_capture_stops_on_other_errors(keithley: Keithley, monkeypatch):
+    def broken():
+        raise ValueError("broken")
+
+    monkeypatch.setattr(keithley, "get_readbacks", broken)
+    capture = Capture(keithley)
+    capture.arm()
+    cothread.Sleep(0.1)
+    assert not capture.armed
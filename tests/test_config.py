@@ -0,0 +1,21 @@
+import pytest
+
+from arc_hvbias.config import Instrument, load_config
+
+
+def test_load_config(tmp_path):
+    path = tmp_path / "hvbias.ini"
+    path.write_text(
+        "[HV-01]\nport = /dev/ttyS0\n\n[HV-02]\nport = /dev/ttyS1\nbaud = 9600\n"
+    )
+    assert load_config(str(path)) == [
+        Instrument("/dev/ttyS0", 34800, "HV-01"),
+        Instrument("/dev/ttyS1", 9600, "HV-02"),
+    ]
+
+
+def test_load_config_rejects_shared_port(tmp_path):
+    path = tmp_path / "hvbias.ini"
+    path.write_text("[HV-01]\nport = /dev/ttyS0\n\n[HV-02]\nport = /dev/ttyS0\n")
+    with pytest.raises(ValueError):
+        load_config(str(path))
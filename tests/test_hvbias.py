@@ -0,0 +1,76 @@
+import cothread
+import numpy as np
+
+from arc_hvbias.keithley import RampEngine
+from arc_hvbias.metrics import Outcome
+from arc_hvbias.planner import compile_cycle
+from arc_hvbias.profiler import CommandClass
+from arc_hvbias.status import Status
+
+
+def test_list_cycle_while_polling(devices):
+    device = devices()
+    device.cycle_engine.set(1)
+    for _ in range(3):
+        expected = compile_cycle(
+            device.settings(),
+            device.k.get_voltage(),
+            min_interval=device.k.reading_time(),
+        )
+        device.cycle_control()
+        # no readback ran the trigger model between its set up and :INIT
+        assert len(device.k.trace_readings) == len(expected.volts)
+        assert device.history.cycles[-1].outcome == Outcome.COMPLETED
+
+
+def test_sweep_ramps_while_capturing(devices):
+    device = devices()
+    device.k.ramp_engine = RampEngine.SWEEP
+    device.capture.arm()
+    for to_volts in (100, 0) * 5:
+        device.ramp(to_volts, 0.2)
+        assert len(device.k.trace_readings) == 21
+        assert np.abs(device.k.trace_readings[-1, 0]) == to_volts
+    device.capture.disarm()
+
+
+def test_no_cycle_while_tripped(devices):
+    device = devices()
+    device.set_current_limit(1e-5)
+    device.k.set_voltage(100)
+    cothread.Sleep(0.5)
+    assert device.k.tripped and device.status == Status.ERROR
+
+    last_time = device.last_time
+    for engine in (0, 1):
+        device.cycle_engine.set(engine)
+        device.cycle_control()
+    assert device.status == Status.ERROR
+    assert device.last_time == last_time
+    assert len(device.history) == 0
+
+
+def test_refusal_reported_once(devices, capsys):
+    device = devices()
+    device.step_size.set(0)
+    # as MAX-TIME calls for a cycle on every poll
+    for _ in range(3):
+        device.cycle_control()
+    assert capsys.readouterr().out.count("cycle refused") == 1
+
+    device.on_setpoint.set(60)
+    device.cycle_control()
+    assert capsys.readouterr().out.count("cycle refused") == 1
+    assert len(device.history) == 0
+
+
+def test_fast_poll_allows_for_readbacks(devices):
+    device = devices()
+    device.fast_poll_rate.set(1000)
+    # so that the update loop leaves the status alone
+    device.ramping = True
+    device.set_status(Status.RAMP_UP)
+    device.k.get_readbacks()
+    # two round trips and a reading, longer than one compound query
+    assert device.k.readback_max > device.k.latency(CommandClass.COMPOUND)
+    assert device.poll_period() == device.k.readback_max
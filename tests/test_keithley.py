@@ -0,0 +1,171 @@
+from time import monotonic
+
+import cothread
+import numpy as np
+import pytest
+import serial
+
+from arc_hvbias.keithley import Keithley, RampEngine
+from arc_hvbias.profiles import RampProfile
+from arc_hvbias.response import ResponseError
+
+
+def test_readbacks(keithley: Keithley):
+    keithley.set_voltage(100)
+    volts, amps, state = keithley.get_readbacks()
+    assert (volts, state) == (-100, 1)
+    assert amps < 0
+
+
+def test_manual_ramp(keithley: Keithley):
+    # wait for the startup commands to be processed
+    keithley.get_voltage()
+    start = monotonic()
+    keithley.ramp(50, 5, 0.5)
+    assert monotonic() - start == pytest.approx(0.5, abs=0.05)
+    assert keithley.get_voltage() == -50
+
+
+def test_sweep_ramp(keithley: Keithley):
+    keithley.ramp_engine = RampEngine.SWEEP
+    keithley.ramp(50, 5, 0.5)
+    assert keithley.get_voltage() == -50
+    assert keithley.trace_readings.shape == (11, 3)
+    assert keithley.trace_readings[-1, 0] == -50
+
+
+def test_trace_hold(keithley: Keithley):
+    keithley.set_voltage(20)
+    keithley.trace_hold(0.5, 0.05)
+    volts, amps, seconds = keithley.trace_readings.T
+    assert len(volts) == 10
+    assert (volts == -20).all()
+    assert np.diff(seconds) == pytest.approx(0.05, abs=0.01)
+
+
+def test_trace_hold_includes_reading_time(keithley: Keithley):
+    keithley.set_voltage(20)
+    start = monotonic()
+    keithley.trace_hold(1.0)
+    # each reading's integration is part of its interval, not added to it
+    expected = 1.0 + keithley.trace_overhead(100)
+    assert monotonic() - start == pytest.approx(expected, abs=0.2)
+    seconds = keithley.trace_readings[:, 2]
+    assert len(seconds) == 100
+    assert np.diff(seconds).mean() == pytest.approx(0.01, abs=0.002)
+
+
+def test_abort_wakes_ramp(keithley: Keithley):
+    task = cothread.Spawn(keithley.ramp, 100, 1, 10)
+    cothread.Sleep(0.5)
+    keithley.abort()
+    start = monotonic()
+    task.Wait(1)
+    assert monotonic() - start < 0.05
+    assert keithley.get_voltage() > -50
+
+
+def test_cancelled_step_is_not_counted(keithley: Keithley):
+    keithley.transport.depth = 1
+    keithley.send_recv(":TRIGGER:SEQ1:DELAY 0.5")
+    # steps of 5 V every 0.2 s
+    ramp = cothread.Spawn(keithley.ramp, 50, 5, 2.0)
+    cothread.Sleep(0.3)
+    # a slow reading fills the pipeline, holding back the second step
+    reading = cothread.Spawn(keithley.measure_current)
+    cothread.Sleep(0.2)
+    keithley.abort()
+    ramp.Wait(1)
+    reading.Wait(1)
+    assert keithley.steps_sent == len(keithley.step_times) == 1
+    assert keithley.get_voltage() == -5
+
+
+def test_current_interlock(keithley: Keithley):
+    trips = []
+    keithley.on_trip = lambda amps, latency: trips.append((amps, latency))
+    keithley.set_current_limit(1e-5)
+    keithley.set_voltage(100)
+    volts, amps, state = keithley.get_readbacks()
+
+    assert keithley.tripped and len(trips) == 1
+    assert trips[0][0] == amps
+    # the trip was seen by this readback, so without waiting for a poll
+    assert 0 < trips[0][1] < keithley.abort_bound(0)
+    assert keithley.get_source_status() == 0
+    # nothing turns the output back on until the interlock is reset
+    keithley.source_on(1)
+    assert keithley.get_source_status() == 0
+
+
+def test_compliance_during_sweep(keithley: Keithley):
+    keithley.set_current_limit(1e-5)
+    keithley.ramp_engine = RampEngine.SWEEP
+    keithley.ramp(100, 5, 0.5)
+
+    # the hardware clamped the current and the software interlock tripped on it
+    amps = np.abs(keithley.trace_readings[:, 1])
+    assert amps.max() == pytest.approx(1.1e-5)
+    assert keithley.tripped
+    assert keithley.get_source_status() == 0
+
+
+def test_compliance_during_list(keithley: Keithley):
+    keithley.set_current_limit(1e-5)
+    keithley.run_sequence(np.linspace(0, 100, 21), 0.01)
+
+    amps = np.abs(keithley.trace_readings[:, 1])
+    assert amps.max() == pytest.approx(1.1e-5)
+    assert keithley.tripped
+
+
+def test_trace_overrun_is_an_error(keithley: Keithley):
+    # the trigger model takes 1.5 s but only 0.1 s was allowed for it
+    with pytest.raises(ResponseError):
+        keithley.run_trace(30, 0.05, 0.1)
+    assert keithley.abort_flag
+    assert len(keithley.trace_readings) == 0
+
+
+def test_reconnect_keeps_bias(keithley: Keithley):
+    keithley.set_voltage(100)
+    port = keithley.transport.port
+    keithley.transport.close()
+
+    k = Keithley(port)
+    assert k.connect()
+    assert k.get_readbacks()[::2] == (-100, 1)
+    k.transport.close()
+
+
+def test_connect_missing_port():
+    k = Keithley("/dev/arc-hvbias-missing")
+    # nothing is sent until connect
+    assert k.send_recv("*idn?") == ""
+    with pytest.raises(serial.SerialException):
+        k.connect()
+    assert not k.connected
+
+
+def test_list_sweep_ramp(keithley: Keithley):
+    keithley.ramp_engine = RampEngine.SWEEP
+    keithley.ramp_profile = RampProfile.S_CURVE
+    keithley.ramp(100, 1, 1.0)
+    assert keithley.get_voltage() == -100
+    # longer than one source list command
+    volts = keithley.trace_readings[:, 0]
+    assert len(volts) == 101
+    assert volts[:5] == pytest.approx(0, abs=0.5)
+    assert volts[-1] == -100
+
+
+@pytest.mark.parametrize("delay", [0.0, 0.02, 0.05, 0.08])
+def test_abort_before_sweep_starts(keithley: Keithley, delay: float):
+    keithley.ramp_engine = RampEngine.SWEEP
+    task = cothread.Spawn(keithley.ramp, 100, 1, 3)
+    cothread.Sleep(delay)
+    start = monotonic()
+    keithley.abort()
+    task.Wait(5)
+    assert monotonic() - start < 0.5
+    assert keithley.get_voltage() > -100
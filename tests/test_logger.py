@@ -0,0 +1,20 @@
+import numpy as np
+
+from arc_hvbias.logger import CHUNK_ROWS, LOG_DTYPE, Logger, read_segment, segment_paths
+
+
+def test_logger_rotates_and_reads_back(tmp_path):
+    # rotate after every chunk
+    logger = Logger(str(tmp_path), "HV-01", rotate_bytes=LOG_DTYPE.itemsize)
+    rows = CHUNK_ROWS * 2 + 10
+    for i in range(rows):
+        logger.log(-i, i / 1000, 1, 2)
+    logger.close()
+
+    paths = segment_paths(str(tmp_path), "HV-01")
+    assert len(paths) == 3
+    logged = np.concatenate([read_segment(path) for path in paths])
+    assert logger.rows_written == len(logged) == rows
+    assert logged["volts"].tolist() == [-i for i in range(rows)]
+    assert (np.diff(logged["time"]) >= 0).all()
+    assert set(logged["status"]) == {2}
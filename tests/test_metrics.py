@@ -0,0 +1,39 @@
+import csv
+
+import numpy as np
+import pytest
+
+from arc_hvbias.metrics import PHASES, CycleHistory, CycleRecorder, Outcome
+from arc_hvbias.status import Status
+
+
+def test_recorder():
+    recorder = CycleRecorder(steps=10)
+    recorder.enter(Status.RAMP_UP)
+    recorder.enter(Status.VOLTAGE_OFF)
+    # (seconds, volts, mA) with a triangular current pulse
+    samples = np.array([[0, 0, 0], [1, -50, -2], [2, -50, 0], [3, -50, 0]], float)
+    metrics = recorder.finish(samples, 25, Outcome.STOPPED)
+
+    assert metrics.steps == 15
+    assert metrics.peak_current == 2
+    assert metrics.charge == pytest.approx(2)
+    assert metrics.outcome == Outcome.STOPPED
+    assert len(metrics.phases) == len(PHASES)
+    assert 0 <= metrics.duration < 1
+
+
+def test_history_is_bounded(tmp_path):
+    history = CycleHistory(length=3)
+    for steps in range(5):
+        recorder = CycleRecorder(0)
+        history.add(recorder.finish(np.zeros((0, 3)), steps, Outcome.COMPLETED))
+    assert len(history) == 3
+    assert list(history.column("steps")) == [2, 3, 4]
+
+    path = tmp_path / "cycles.csv"
+    history.export(str(path))
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    assert [row["steps"] for row in rows] == ["2", "3", "4"]
+    assert rows[0]["outcome"] == "COMPLETED"
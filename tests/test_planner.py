@@ -0,0 +1,80 @@
+from time import monotonic
+
+import numpy as np
+import pytest
+
+from arc_hvbias.keithley import Keithley
+from arc_hvbias.planner import CycleSettings, Verdict, compile_cycle, plan_cycle
+
+SETTINGS = CycleSettings(
+    on_volts=50,
+    off_volts=0,
+    rise_time=0.5,
+    hold_time=0.2,
+    fall_time=0.5,
+    repeats=2,
+    step_size=5,
+)
+
+
+def test_plan_matches_cycle(keithley: Keithley):
+    keithley.ramp(50, 5, 0.2)
+    plan = plan_cycle(keithley, SETTINGS, keithley.get_voltage())
+    assert plan.verdict == Verdict.OK
+    assert plan.step_size == 5
+
+    # the same ramps as cycle_control, which also holds between them
+    start = monotonic()
+    keithley.ramp(50, 5, 0.5)
+    for _ in range(SETTINGS.repeats):
+        keithley.ramp(0, 5, 0.5)
+        keithley.ramp(50, 5, 0.5)
+    holds = (2 * SETTINGS.repeats - 1) * SETTINGS.hold_time
+    assert plan.duration == pytest.approx(monotonic() - start + holds, abs=0.2)
+
+
+def test_plan_warns_and_refuses(keithley: Keithley):
+    fine = plan_cycle(keithley, SETTINGS._replace(step_size=0.1), -50)
+    assert fine.verdict == Verdict.WARNING
+    assert fine.step_size > 0.1
+
+    refused = plan_cycle(keithley, SETTINGS._replace(rise_time=0), -50)
+    assert refused.verdict == Verdict.REFUSED
+
+
+def test_compile_cycle():
+    sequence = compile_cycle(SETTINGS, 0, points=51)
+    # ramp 0.5, (ramp 0.5, hold 0.2, ramp 0.5) twice with a hold between
+    assert sequence.duration == pytest.approx(3.1)
+    volts = sequence.volts
+    assert (volts[0], volts[-1]) == (0, -50)
+    assert volts.max() == 0 and volts.min() == -50
+    # the hold at the off voltage in each repeat
+    assert (volts == 0).sum() == 1 + 2 * 3
+
+
+def test_plan_matches_list_cycle(keithley: Keithley):
+    settings = SETTINGS._replace(list_cycle=True)
+    keithley.set_voltage(50)
+    plan = plan_cycle(keithley, settings, -50)
+    assert plan.verdict == Verdict.OK
+
+    sequence = compile_cycle(settings, -50)
+    start = monotonic()
+    keithley.run_sequence(sequence.volts, sequence.delay)
+    assert plan.duration == pytest.approx(monotonic() - start, abs=0.2)
+    assert len(keithley.trace_readings) == len(sequence.volts)
+    assert keithley.get_voltage() == -50
+
+
+def test_compile_cycle_meets_step_size():
+    sequence = compile_cycle(SETTINGS._replace(step_size=0.5), 0)
+    assert len(sequence.volts) > 100
+    assert np.abs(np.diff(sequence.volts)).max() <= 0.5
+
+
+def test_plan_refuses_coarse_list_cycle(keithley: Keithley):
+    # finer than the 2400's longest source list can step
+    settings = SETTINGS._replace(list_cycle=True, step_size=0.05)
+    plan = plan_cycle(keithley, settings, -50)
+    assert plan.verdict == Verdict.REFUSED
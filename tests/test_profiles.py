@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from arc_hvbias.profiles import SEGMENT_SPEEDUP, RampProfile, setpoints
+
+
+@pytest.mark.parametrize("profile", list(RampProfile))
+def test_profiles_reach_target(profile: RampProfile):
+    volts = setpoints(profile, -500, 0, 50)
+    assert len(volts) == 50
+    assert volts[-1] == 0
+    # ramps are monotonic and never overshoot
+    assert (np.diff(np.insert(volts, 0, -500)) >= 0).all()
+    assert volts.max() <= 0
+
+
+def test_profile_shapes():
+    linear = setpoints(RampProfile.LINEAR, 0, -100, 10)
+    assert linear == pytest.approx(np.arange(-10, -101, -10))
+    # exponential makes most of the change early, the S-curve late
+    assert setpoints(RampProfile.EXPONENTIAL, 0, -100, 10)[1] < -50
+    s_curve = setpoints(RampProfile.S_CURVE, 0, -100, 10)
+    assert s_curve[0] > -5 and s_curve[4] == pytest.approx(-50)
+
+
+def test_segmented_fast_near_zero():
+    volts = setpoints(RampProfile.SEGMENTED, 0, -500, 100)
+    rates = -np.diff(np.insert(volts, 0, 0))
+    assert rates[0] == pytest.approx(SEGMENT_SPEEDUP * rates[-1])
+    # the first half of the voltage takes a fifth of the time
+    assert volts[19] == pytest.approx(-250)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from arc_hvbias.publish import Publisher
+
+
+class Record:
+    def __init__(self):
+        self.values = []
+
+    def set(self, value):
+        self.values.append(value)
+
+
+def test_publisher_posts_outside_deadband():
+    publisher = Publisher()
+    volts = publisher.add(Record(), absolute=0.5)
+    amps = publisher.add(Record(), relative=0.1)
+    state = publisher.add(Record())
+
+    for v, a, s in [
+        (10, 1.0, 0),
+        (10.2, 1.05, 0),
+        (10.6, 1.2, 0),
+        (10.6, 1.2, np.True_),
+    ]:
+        volts.set(v)
+        amps.set(a)
+        state.set(s)
+        publisher.flush()
+
+    assert volts.record.values == [10, 10.6]
+    assert amps.record.values == [1.0, 1.2]
+    assert state.record.values == [0, 1]
+    assert publisher.posts == 6
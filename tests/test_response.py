@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from arc_hvbias.response import ResponseError, decode_ascii, decode_block
+
+
+def test_decode_ascii():
+    values = decode_ascii("-5.000000E+02;1.0E-07;1\n", 3)
+    assert values.tolist() == [-500, 1e-7, 1]
+
+
+@pytest.mark.parametrize("reply", ["", "-5.0E+02;ERR", "1,2"])
+def test_decode_ascii_rejects_malformed(reply):
+    with pytest.raises(ResponseError):
+        decode_ascii(reply, 3)
+
+
+def test_decode_block():
+    data = b"#0" + np.array([1.5, -2, 3], "<f4").tobytes() + b"\n"
+    assert decode_block(data, 3).tolist() == [1.5, -2, 3]
+    with pytest.raises(ResponseError):
+        decode_block(data[:-4], 3)
@@ -0,0 +1,112 @@
+import itertools
+from time import monotonic
+
+import cothread
+import pytest
+
+from arc_hvbias.metrics import Outcome
+from arc_hvbias.scheduler import Barrier, CycleMode, CycleScheduler
+
+# record prefixes are unique in the process, so each scheduler gets its own
+PREFIXES = (f"TEST-HV-ALL-{n:02d}" for n in itertools.count(1))
+# seconds allowed for a cycle to end or start later than planned
+SLACK = 0.5
+
+
+def test_barrier_releases_together_and_on_leave():
+    barrier = Barrier(3)
+    passed = []
+
+    def party(name: str, phases: int):
+        for phase in range(phases):
+            barrier.wait()
+            passed.append((phase, name))
+        barrier.leave()
+
+    tasks = [cothread.Spawn(party, name, 2) for name in "ab"]
+    tasks.append(cothread.Spawn(party, "c", 1))
+    cothread.Sleep(0.1)
+    for task in tasks:
+        task.Wait(1)
+
+    # nobody passes phase 0 until all three arrive, and c leaving after its
+    # only phase lets a and b through phase 1 without it
+    assert sorted(passed) == [(0, "a"), (0, "b"), (0, "c"), (1, "a"), (1, "b")]
+
+
+def test_host_cycle_keeps_time_beside_list_cycle(devices):
+    host, listed = devices(), devices()
+    barrier = Barrier(2)
+    for device in (host, listed):
+        device.barrier = barrier
+    listed.cycle_engine.set(1)
+
+    start = monotonic()
+    tasks = [cothread.Spawn(d.cycle_control) for d in (host, listed)]
+    tasks[0].Wait(10)
+    # the host device did not wait for the list to finish at its next phase
+    assert monotonic() - start < host.nominal_duration() + 1.0
+    tasks[1].Wait(10)
+    assert len(listed.history) == 1
+
+
+def wait_cycles(*devices, count: int = 1, timeout: float = 20.0):
+    deadline = monotonic() + timeout
+    while any(len(d.history) < count for d in devices):
+        assert monotonic() < deadline, "cycles did not finish"
+        cothread.Sleep(0.1)
+
+
+def test_staggered_cycles_overlap(devices):
+    first, second = devices(), devices()
+    scheduler = CycleScheduler([first, second], next(PREFIXES))
+    scheduler.overlap.set(0.5)
+    scheduler.run(CycleMode.STAGGERED)
+
+    a, b = first.history.cycles[-1], second.history.cycles[-1]
+    assert (a.outcome, b.outcome) == (Outcome.COMPLETED, Outcome.COMPLETED)
+    # the second started about OVERLAP before the first ended
+    assert a.end - b.start == pytest.approx(0.5, abs=SLACK)
+
+
+def test_rolling_cycles_respect_concurrency(devices):
+    made = [devices() for _ in range(3)]
+    scheduler = CycleScheduler(made, next(PREFIXES))
+    scheduler.concurrency.set(2)
+    scheduler.run(CycleMode.ROLLING)
+
+    a, b, c = (device.history.cycles[-1] for device in made)
+    assert abs(a.start - b.start) < SLACK
+    # the third waited for one of the first two to finish
+    assert c.start >= min(a.end, b.end)
+    assert c.start - min(a.end, b.end) < SLACK
+
+
+def test_requested_cycles_take_turns(devices):
+    first, second = devices(), devices()
+    CycleScheduler([first, second], next(PREFIXES))
+    # as MAX-TIME calls for a cycle on every poll until it starts
+    for device in (first, second, first, second):
+        device.request_cycle()
+    wait_cycles(first, second)
+    cothread.Sleep(0.5)
+
+    assert (len(first.history), len(second.history)) == (1, 1)
+    a, b = first.history.cycles[-1], second.history.cycles[-1]
+    # CONCURRENCY is 1, so the second only started once the first had ended
+    assert b.start >= a.end
+
+
+def test_simultaneous_cycles_with_mixed_engines(devices):
+    host, listed = devices(), devices()
+    listed.cycle_engine.set(1)
+    scheduler = CycleScheduler([host, listed], next(PREFIXES))
+    scheduler.run(CycleMode.SIMULTANEOUS)
+
+    a, b = host.history.cycles[-1], listed.history.cycles[-1]
+    assert (a.outcome, b.outcome) == (Outcome.COMPLETED, Outcome.COMPLETED)
+    assert abs(a.start - b.start) < SLACK
+    # kept to its own times, starting with the ramp from 0 V to the on voltage
+    expected = host.fall_time.get() + host.nominal_duration()
+    assert a.duration == pytest.approx(expected, abs=SLACK)
+    assert host.barrier is None and listed.barrier is None
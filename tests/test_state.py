@@ -0,0 +1,19 @@
+from arc_hvbias.state import BiasState, StateTracker
+
+
+def test_state_settles_before_changing():
+    tracker = StateTracker(tolerance=1.0, settle_time=0.5)
+    assert tracker.update(0.0, -500.2, 1, 500, 0) == BiasState.AT_ON
+
+    # a glitch shorter than the settling time is ignored, as is rounding
+    assert tracker.update(0.1, -480, 1, 500, 0) == BiasState.AT_ON
+    assert tracker.update(0.2, -499.4, 1, 500, 0) == BiasState.AT_ON
+
+    # a change is accepted once it has lasted the settling time
+    for now in (0.3, 0.5, 0.7):
+        assert tracker.update(now, -0.4, 1, 500, 0) == BiasState.AT_ON
+    assert tracker.update(0.8, 0.3, 1, 500, 0) == BiasState.AT_OFF
+    assert tracker.changed == 0.8
+
+    assert tracker.update(2.0, 0.0, 0, 500, 0) == BiasState.AT_OFF
+    assert tracker.update(2.5, 0.0, 0, 500, 0) == BiasState.OUTPUT_OFF
@@ -0,0 +1,49 @@
+from typing import List
+
+import cothread
+import pytest
+
+from arc_hvbias.keithley import Keithley
+from arc_hvbias.response import ResponseError
+from arc_hvbias.supervisor import LinkSupervisor
+
+
+def test_resync_after_late_reply(keithley: Keithley):
+    supervisor = LinkSupervisor(keithley)
+    # give up on a reply before it arrives, so that it answers the next query
+    assert keithley.send_recv(":SOURCE:VOLTAGE?", timeout=0) == ""
+    with pytest.raises(ResponseError) as error:
+        keithley.get_readbacks()
+
+    supervisor.recover(error.value)
+    assert (supervisor.resyncs, supervisor.reconnects) == (1, 0)
+    assert keithley.get_readbacks()[2] == 1
+
+
+def test_reconnect_after_port_failure(keithley: Keithley):
+    changes: List[bool] = []
+    supervisor = LinkSupervisor(keithley, changes.append)
+    keithley.transport.fail(OSError("unplugged"))
+    with pytest.raises(ResponseError) as error:
+        keithley.get_readbacks()
+
+    supervisor.recover(error.value)
+    assert (supervisor.resyncs, supervisor.reconnects) == (0, 1)
+    assert changes == [False, True]
+    assert keithley.connected and supervisor.uptime > 0
+    # the output was on so it was not reset by the reconnect
+    assert keithley.get_readbacks()[2] == 1
+
+
+def test_errors_during_recovery_wait_for_it(keithley: Keithley):
+    supervisor = LinkSupervisor(keithley)
+    assert keithley.send_recv(":SOURCE:VOLTAGE?", timeout=0) == ""
+    with pytest.raises(ResponseError) as error:
+        keithley.get_readbacks()
+
+    # as when the update loop and the capture both see the error
+    tasks = [cothread.Spawn(supervisor.recover, error.value) for _ in range(2)]
+    for task in tasks:
+        task.Wait()
+    assert (supervisor.resyncs, supervisor.reconnects) == (1, 0)
+    assert keithley.get_readbacks()[2] == 1
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from arc_hvbias.trend import TrendEstimator
+
+
+def test_trend_matches_fit_over_window():
+    rng = np.random.default_rng(1)
+    times = 1e6 + np.arange(2000) * 0.5
+    current = 1e-3 + 2e-8 * (times - times[0]) + rng.normal(0, 1e-7, len(times))
+
+    trend = TrendEstimator(window=100)
+    for t, y in zip(times, current):
+        trend.add(t, y)
+
+    # the last 100 seconds plus the sample before them
+    window = slice(-201, None)
+    slope, intercept = np.polyfit(times[window], current[window], 1)
+    assert trend.n == 201
+    assert trend.span == 100
+    assert trend.slope() == pytest.approx(slope, rel=1e-6)
+    assert trend.mean() == pytest.approx(current[window].mean())
+    assert trend.stdev() == pytest.approx(current[window].std(ddof=1), rel=1e-6)
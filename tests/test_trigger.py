@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Iterator, List
+
+import cothread
+import pytest
+
+from arc_hvbias.trigger import IdleTrigger
+
+# seconds allowed for a monitor to connect, or to see its PV disconnect
+CONNECT_DELAY = 1.0
+# seconds allowed for an update to reach a monitor
+UPDATE_DELAY = 0.2
+
+
+def test_idle_trigger_cycles_in_long_enough_gaps():
+    started = []
+    trigger = IdleTrigger(lambda: 5.0, lambda: True, lambda: started.append(1))
+
+    # gaps of 6 seconds between acquisitions
+    now = 0.0
+    for _ in range(4):
+        trigger.transition(False, now)
+        trigger.transition(True, now + 6)
+        now += 10
+    assert trigger.predictor.predict() == 6
+    # no cycle until enough gaps have been seen to predict the next
+    assert len(started) == 1
+
+    # the first short gaps are outvoted by the long ones, then the
+    # prediction falls below the required cycle time
+    for _ in range(10):
+        trigger.transition(False, now)
+        trigger.transition(True, now + 2)
+        now += 10
+    assert trigger.triggered == len(started) == 3
+
+
+class Detector(object):
+    """
+    A detector IOC serving ACQUIRING from another process, see acquiring_ioc
+    """
+
+    def __init__(self, prefix: str):
+        self.pv = f"{prefix}:ACQUIRING"
+        self.ioc = subprocess.Popen(
+            [sys.executable, str(Path(__file__).parent / "acquiring_ioc.py"), prefix],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        # iocInit prints its own lines first, and nothing more if it fails
+        assert self.ioc.stdout is not None
+        for line in self.ioc.stdout:
+            if line.strip() == "ready":
+                break
+        else:
+            pytest.fail("detector IOC did not start")
+
+    def send(self, command: str):
+        """
+        Send the IOC a command and wait for the update to reach monitors
+        """
+        assert self.ioc.stdin is not None
+        self.ioc.stdin.write(command + "\n")
+        self.ioc.stdin.flush()
+        cothread.Sleep(UPDATE_DELAY)
+
+    def stop(self):
+        if self.ioc.returncode is None:
+            self.ioc.kill()
+            # waits for it to exit and closes the pipes
+            self.ioc.communicate()
+
+
+@pytest.fixture
+def detector() -> Iterator[Detector]:
+    detector = Detector(f"TEST-DET-{os.getpid()}")
+    yield detector
+    detector.stop()
+
+
+def test_idle_trigger_follows_acquiring_pv(detector: Detector):
+    started: List[int] = []
+    trigger = IdleTrigger(lambda: 0.3, lambda: True, lambda: started.append(1))
+    trigger.connect(detector.pv)
+    cothread.Sleep(CONNECT_DELAY)
+    assert trigger.acquiring
+
+    for _ in range(3):
+        detector.send("0")
+        cothread.Sleep(0.5)
+        detector.send("1")
+    # each gap includes the wait for the update ending it
+    gap = 0.5 + UPDATE_DELAY
+    assert trigger.predictor.predict() == pytest.approx(gap, abs=0.1)
+    assert started == []
+
+    # the predicted gap is now known to be long enough for a cycle
+    detector.send("0")
+    assert not trigger.acquiring and started == [1]
+    # the detector's state is unknown while its record is INVALID
+    detector.send("INVALID")
+    assert trigger.acquiring
+    detector.send("0")
+    assert not trigger.acquiring and started == [1, 1]
+
+    # and while it is disconnected
+    detector.stop()
+    cothread.Sleep(CONNECT_DELAY)
+    assert trigger.acquiring
+    trigger.close()